@@ -0,0 +1,49 @@
+# Benchmark of read_dat against np.loadtxt on a *.dat file as written by db_extractor.
+# Checks that both give bit-identical values and prints the throughput in rows/s.
+#
+# read_dat parses with pyarrow when it is installed. On one core with numpy 2.4, whose np.loadtxt is written in C,
+# 1M rows x 4 columns read about 4x faster than with np.loadtxt, pyarrow spreads the parsing over all cores on larger
+# machines. Without pyarrow read_dat uses np.loadtxt and is as fast as it.
+#
+# Usage: python benchmarks/bench_dat_reader.py [number of rows] [number of columns] [number of set axes]
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+from qctools.db_extraction import _write_dat_rows
+from qctools.dat_reader import read_dat
+from bench_dat_writer import make_matrix
+
+def write_dat(path, run_matrix, lset):
+    names = ['x' + str(k) for k in range(0,run_matrix.shape[1])]
+    header = 'Run #1: bench, Experiment: bench, Sample name: bench, Number of values: ' + str(len(run_matrix)) + '\n'
+    header += 'Comment: None \n'
+    header += '\t'.join(names) + '\t\n'
+    header += '\t'.join([name + ' (V)' for name in names]) + '\t'
+    with open(path, 'wb') as f:
+        np.savetxt(f,np.array([]), header = header)
+        _write_dat_rows(f, run_matrix, lset, True)
+
+def bench(reader, path, repeats=3):
+    best = np.inf
+    for i in range(0,repeats):
+        start = time.perf_counter()
+        data = reader(path)
+        best = min(best, time.perf_counter() - start)
+    return best, data
+
+if __name__ == '__main__':
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    ncols = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    nset = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    run_matrix = make_matrix(nrows, ncols, nset)
+    path = os.path.join(tempfile.mkdtemp(), 'bench.dat')
+    write_dat(path, run_matrix, nset)
+    told, dataold = bench(np.loadtxt, path)
+    tnew, datanew = bench(lambda path: read_dat(path).data, path)
+    identical = np.array_equal(dataold.view(np.int64), datanew.view(np.int64))
+    print('Rows: {}, columns: {}, set axes: {}, values identical: {}'.format(nrows, ncols, nset, identical))
+    print('np.loadtxt: {:10.0f} rows/s'.format(nrows/told))
+    print('read_dat:   {:10.0f} rows/s ({:.1f}x)'.format(nrows/tnew, told/tnew))
+    os.remove(path)
@@ -0,0 +1,53 @@
+# Benchmark of the *.dat text writer of db_extractor against the previous np.savetxt per slow axis slice routine.
+# Checks that both produce byte-identical output and prints the throughput in rows/s.
+#
+# Usage: python benchmarks/bench_dat_writer.py [number of rows] [number of columns] [number of set axes]
+import io
+import sys
+import time
+import numpy as np
+from qctools.db_extraction import _write_dat_rows
+
+# Previous routine: split on every slow axis change and call np.savetxt per slice
+def write_savetxt(f, run_matrix, lset, newline_slowaxes):
+    slicearray = np.array([]).astype(int)
+    if newline_slowaxes == True:
+        for i in range(0,lset-1):
+            slicearray = np.concatenate((slicearray, np.where(run_matrix[:-1,i] != run_matrix[1:,i])[0]+1))
+            slicearray = np.unique(slicearray)
+    vsliced=np.split(run_matrix,slicearray, axis=0)
+    for i in range(0,len(vsliced)):
+        np.savetxt(f,vsliced[i],delimiter='\t')
+        if i != len(vsliced)-1:
+            f.write("\n".encode())
+
+def make_matrix(nrows, ncols, nset, nfast=100):
+    # N-d map: nset set axes with nfast points each (the slowest axis takes the remaining rows) and ncols-nset measured
+    # columns, with a few nans as for an unfinished run
+    run_matrix = np.random.randn(nrows, ncols)
+    rows = np.arange(nrows)
+    run_matrix[:,0] = rows // nfast**(nset-1)
+    for k in range(1,nset):
+        run_matrix[:,k] = np.linspace(-1, 1, nfast)[(rows // nfast**(nset-1-k)) % nfast]
+    run_matrix[-3:,-1] = np.nan
+    return run_matrix
+
+def bench(writer, run_matrix, lset, repeats=3):
+    best = np.inf
+    for i in range(0,repeats):
+        f = io.BytesIO()
+        start = time.perf_counter()
+        writer(f, run_matrix, lset, True)
+        best = min(best, time.perf_counter() - start)
+    return best, f.getvalue()
+
+if __name__ == '__main__':
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    ncols = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    nset = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    run_matrix = make_matrix(nrows, ncols, nset)
+    told, outold = bench(write_savetxt, run_matrix, nset)
+    tnew, outnew = bench(_write_dat_rows, run_matrix, nset)
+    print('Rows: {}, columns: {}, set axes: {}, output identical: {}'.format(nrows, ncols, nset, outold == outnew))
+    print('np.savetxt per slice: {:10.0f} rows/s'.format(nrows/told))
+    print('_write_dat_rows:      {:10.0f} rows/s ({:.1f}x)'.format(nrows/tnew, told/tnew))
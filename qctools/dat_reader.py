@@ -0,0 +1,160 @@
+import re
+import io
+import gzip
+import numpy as np
+from qctools.gridding import grid_axes, to_grid
+
+# Reader for the *.dat files written by db_extractor (also .dat.gz and .dat.zst), as a fast replacement of np.loadtxt
+# and hand-parsing of the header:
+#
+#   dat = read_dat(path)
+#   dat['x'], dat['a']              columns by name, dat.data is the full matrix
+#   dat.labels, dat.units, dat.run_id, dat.comment, ...
+#   dat = read_dat(path, grid=True)
+#   dat.shape, dat.axes, dat.grid('a')   grid shape, axis values and the column as N-d array, see gridding.py
+#
+# The body is parsed with the multithreaded C parser of pyarrow when it is installed, otherwise with np.loadtxt. Both
+# round correctly, so the values are bit-identical to np.loadtxt.
+
+# Opens a *.dat, *.dat.gz or *.dat.zst file for reading bytes
+def _open_dat(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading *.dat.zst files requires the zstandard package.")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+        return io.BufferedReader(reader)
+    return open(path, 'rb')
+
+# Parses the tab separated body of an open file that is positioned after the header, blank lines are skipped.
+# Returns the (rows, ncols) matrix.
+def _read_body(f, ncols, workers):
+    if len(f.peek(1)) == 0:
+        return np.empty((0, ncols))
+    try:
+        import pyarrow
+        import pyarrow.csv
+    except ImportError:
+        return np.loadtxt(f, delimiter='\t', ndmin=2)
+    names = [str(k) for k in range(0, ncols)]
+    table = pyarrow.csv.read_csv(f,
+                                 read_options=pyarrow.csv.ReadOptions(column_names=names, use_threads=workers != 1),
+                                 parse_options=pyarrow.csv.ParseOptions(delimiter='\t'),
+                                 convert_options=pyarrow.csv.ConvertOptions(column_types={name: pyarrow.float64()
+                                                                                         for name in names}))
+    data = np.empty((table.num_rows, ncols))
+    for k, name in enumerate(names):
+        data[:,k] = table.column(name).to_numpy()
+    return data
+
+_run_line = re.compile(r'Run #(\d+): (.*), Experiment: (.*), Sample name: (.*), Number of values: *(\S*)')
+_label_unit = re.compile(r'^(.*) \((.*)\)$')
+
+# Parses the four header lines that db_extractor writes
+def _parse_header(lines):
+    header = {}
+    match = _run_line.match(lines[0][2:].strip())
+    if match is None:
+        raise ValueError('Not a *.dat file written by db_extractor, unknown header: ' + lines[0].strip())
+    header['run_id'] = int(match.group(1))
+    header['run_name'] = match.group(2)
+    header['exp_name'] = match.group(3)
+    header['sample_name'] = match.group(4)
+    header['number_of_values'] = int(match.group(5)) if match.group(5).isdigit() else None
+    comment = lines[1][2:].rstrip('\n')
+    if comment.startswith('Comment: '):
+        header['comment'] = comment[len('Comment: '):].rstrip()
+    else:
+        header['comment'] = None
+    header['names'] = lines[2][2:].rstrip('\n').rstrip('\t').split('\t')
+    header['labels'] = []
+    header['units'] = []
+    for labelunit in lines[3][2:].rstrip('\n').rstrip('\t').split('\t'):
+        match = _label_unit.match(labelunit)
+        if match is None:
+            header['labels'].append(labelunit)
+            header['units'].append('')
+        else:
+            header['labels'].append(match.group(1))
+            header['units'].append(match.group(2))
+    return header
+
+# Number of set columns: the smallest number of leading columns that holds every point only once and forms a grid.
+# Returns the number of set columns and their grid (see grid_axes), or None and None.
+def _infer_grid(data):
+    for nset in range(1, data.shape[1]):
+        grid = grid_axes(data[:,:nset])
+        if grid is not None:
+            return nset, grid
+    return None, None
+
+class dat_file:
+    '''
+    Contents of a *.dat file written by db_extractor, see read_dat. The columns are available by name, dat['x'], and
+    as the full matrix dat.data. The header is parsed into run_id, run_name, exp_name, sample_name, number_of_values,
+    comment, names, labels and units.
+
+    When read with grid=True, shape and axes hold the grid shape and the axis values of the nset set columns (None
+    when the points are no rectangular grid) and grid(name) returns a column as N-d array, see gridding.py.
+    '''
+    def __init__(self, header, data, nset=None, grid=None):
+        for key, value in header.items():
+            setattr(self, key, value)
+        self.data = data
+        self.nset = nset
+        self.shape = None
+        self.axes = None
+        if grid is not None:
+            self.axes = grid[0]
+            self.shape = tuple([len(values) for values in self.axes])
+
+    def __getitem__(self, name):
+        return self.data[:,self.names.index(name)]
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def keys(self):
+        return list(self.names)
+
+    def grid(self, name):
+        if self.shape is None:
+            raise ValueError('The data is no rectangular grid, read it with grid=True or pass nset.')
+        column = self.names.index(name)
+        if column < self.nset:
+            return self.axes[column]
+        return to_grid(self.data[:,list(range(self.nset)) + [column]], self.nset)[1][0]
+
+def read_dat(path, grid=False, nset=None, workers=None):
+    '''
+    Reads a *.dat file written by db_extractor, also compressed as .dat.gz or .dat.zst, and returns a dat_file.
+
+    path: location of the file
+    grid: determine the grid shape and axes of the set columns. Default: False
+    nset: number of set columns, only used for the grid. Default: None, then the smallest number of leading columns
+          that forms a grid is taken.
+    workers: 1 parses the file on a single thread, otherwise pyarrow uses its thread pool. Default: None
+
+    The values are identical to those of np.loadtxt(path), blank lines on the slow axes are skipped. The file is parsed
+    with pyarrow when it is installed, otherwise with np.loadtxt.
+    '''
+    path = str(path)
+    with _open_dat(path) as f:
+        headerlines = []
+        while len(headerlines) < 4:
+            line = f.readline().decode()
+            if not line.startswith('#'):
+                raise ValueError('Not a *.dat file written by db_extractor, expected 4 header lines in ' + path)
+            headerlines.append(line)
+        header = _parse_header(headerlines)
+        data = _read_body(f, len(header['names']), workers)
+    if not grid or len(data) == 0:
+        return dat_file(header, data)
+    if nset is None:
+        nset, setgrid = _infer_grid(data)
+    else:
+        setgrid = grid_axes(data[:,:nset])
+    return dat_file(header, data, nset, setgrid)
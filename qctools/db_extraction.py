@@ -1,10 +1,757 @@
 import qcodes as qc
 from qcodes import initialise_database
 import qcodes.dataset.descriptions.versioning.serialization as sz
+from qcodes.dataset.sqlite.database import connect
+try:
+    from qcodes.dataset.sqlite.connection import ConnectionPlus
+except ImportError: # Newer qcodes versions, the connection class is a subclass of sqlite3.Connection there
+    from qcodes.dataset.sqlite.connection import AtomicConnection
+    ConnectionPlus = None
 import os
 import numpy as np
 import json
-import datetime
+import hashlib
+import gzip
+import io
+import time
+import contextlib
+import shutil
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from urllib.request import pathname2url
+from qctools.gridding import to_grid
+
+_converters_registered = False
+
+# Opens a read-only connection to the database at dbloc. It is opened with the URI mode=ro, so it can be used next to
+# a running measurement without changing qc.config or initialising the database. Reads only take short shared locks
+# per query, for a database in WAL journal mode they never block the datasaver that is writing. The caller closes the
+# connection when it is done, so no handle on the .db file stays open (which would block moving or deleting it on
+# Windows).
+def _readonly_connection(dbloc):
+    global _converters_registered
+    dbloc = os.path.abspath(dbloc)
+    if not _converters_registered:
+        # qcodes registers the numpy/sqlite type converters globally when connecting, do so once on a dummy database
+        connect(':memory:').close()
+        _converters_registered = True
+    uri = 'file:' + pathname2url(dbloc) + '?mode=ro'
+    if ConnectionPlus is not None:
+        conn = sqlite3.connect(uri, uri=True, detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.row_factory = sqlite3.Row
+        conn = ConnectionPlus(conn)
+    else:
+        conn = sqlite3.connect(uri, uri=True, detect_types=sqlite3.PARSE_DECLTYPES, factory=AtomicConnection)
+    return conn
+
+# Collects the parameters of a run and compares the depends of all measured parameters. Returns the parameters,
+# their names and two dicts which describe how the run is split into *.dat files:
+# result_dict: Meas axes dict, rows are independent measurements, values per row are dependent measurements
+# depend_dict: Depends (i.e. set axes) belonging to the measurements in the same column of result_dict.
+def _run_structure(run):
+    parameters = run.get_parameters()
+    num_of_parameters = len(parameters)
+
+    # Getting info on parameters used in the run
+    meas_params = []
+    param_names = [[]] * num_of_parameters
+    depends = [[]] * num_of_parameters
+    for k in range(0,num_of_parameters):
+        param_names[k] = parameters[k].name
+        if parameters[k].depends_on: #Check if measure parameter (i.e. if it has depends), then collect
+            depends[k] = parameters[k].depends_on
+            meas_params.append(k)
+
+    #Compare depends of meas_params and prepare two dicts which describes how the datasaver should process the run
+    result_dict = {}
+    depend_dict = {}
+
+    n = 0
+    #Filling the dicts:
+    for l in meas_params:
+        params_with_equal_depends = [i for i, e in enumerate(depends) if e == depends[l]]
+        if params_with_equal_depends not in result_dict.values():
+            result_dict.update([(n, params_with_equal_depends)])
+            deps = parameters[l].depends_on #Split dependecy string
+            deps = deps.split(', ')
+            depsind = []
+            for o in range(0,len(deps)):
+                depsind.append(param_names.index(deps[o]))
+            depend_dict.update([(n, depsind)])
+            n = n + 1
+    return parameters, param_names, result_dict, depend_dict
+
+# Constructs the folder of a run and the full paths of its *.dat files (one per result_dict entry) and snapshot file
+def _run_filepaths(run, runid, expid, expname, samplename, dbpath, nfiles, timestamp, paramtofilename, no_folders):
+    folderstring = f'Exp' + '{:02d}'.format(expid) + f'({expname})' + '-Sample' + f'({samplename})'
+
+    # Adding optional file folder settings
+    if timestamp:
+        timestampcut = str(run.run_timestamp()).replace(":", "").replace("-", "").replace(" ","-")
+    else:
+        timestampcut = ''
+
+    if paramtofilename:
+        runparams = '_' + run.parameters
+    else:
+        runparams = ''
+
+    #Constructing final filepath
+    filenamep1 = "{:03d}".format(runid) + '_' + timestampcut + '_' + run.name
+    if no_folders == True:
+        folder = (dbpath.split('.')[0])
+    else:
+        folder = os.path.join((dbpath.split('.')[0]),folderstring,filenamep1)
+    #folder = folder.replace(" ", "_").replace('?','_')
+    folder = folder.replace('?','_')
+
+    if no_folders == True:
+        filenamejson = '{:03d}'.format(runid) + '-' + "run_snapshot.json"
+    else:
+        filenamejson = "run_snapshot.json"
+    fullpaths = []
+    for n in range(0,nfiles):
+        if no_folders == True:
+            #If number of files > 1, add a number in front
+            if nfiles > 1:
+                filenamep2 = '{:03d}'.format(runid) + '-' + str(n) + "_" + run.name + runparams + ".dat"
+            else:
+                filenamep2 = '{:03d}'.format(runid) + '-' + run.name + runparams + ".dat"
+        else:
+            #If number of files > 1, add a number in front
+            if nfiles > 1:
+                filenamep2 = str(n) + "_" + run.name + runparams + ".dat"
+            else:
+                filenamep2 = run.name + runparams + ".dat"
+        filenamep2 = filenamep2.replace(" ", "_").replace('?','_')
+        fullpaths.append(os.path.join(folder,filenamep2))
+    filenamejson = filenamejson.replace(" ", "_").replace('?','_')
+    fullpathjson = os.path.join(folder,filenamejson)
+    return folder, fullpaths, fullpathjson
+
+# Names, labels and units of the set and meas columns of a result_dict entry
+def _column_info(parameters, set_params, meas_params):
+    columns = list(set_params) + list(meas_params)
+    names = [parameters[j].name for j in columns]
+    labels = [parameters[j].label for j in columns]
+    units = [parameters[j].unit for j in columns]
+    return names, labels, units
+
+# Constructs the *.dat file header. It is written with np.savetxt, which adds the '# ' in front of every line.
+def _dat_header(run, runid, expname, samplename, parameters, set_params, meas_params, number_of_values):
+    header = ''
+    header += f"Run #{runid}: {run.name}, Experiment: {expname}, Sample name: {samplename}, Number of values: " + str(number_of_values) + "\n"
+    try:
+        comment = run.get_metadata('Comment')
+        header += f"Comment: {comment} \n"
+    except:
+        header += "\n"
+
+    headernames = ''
+    headerlabelsandunits = ''
+    names, labels, units = _column_info(parameters, set_params, meas_params)
+    for name, label, unit in zip(names, labels, units):
+        headernames += name + "\t"
+        headerlabelsandunits += label + " (" + unit +")" + "\t"
+    header += headernames + '\n'
+    header += headerlabelsandunits
+    return header
+
+# Collects depends (set axes) and measurement (meas axes) columns of one result_dict entry into a single matrix.
+# param_data is the output of run.get_parameter_data() and can be shared by all result_dict entries of a run. The
+# columns are copied straight into the matrix (np.ravel gives a view), only missing values at the end are set to nan.
+def _build_run_matrix(param_data, param_names, set_params, meas_params):
+    lset = len(set_params)
+    lmeas = len(meas_params)
+    tree = param_data[param_names[meas_params[0]]]
+    lval = tree[param_names[meas_params[0]]].size
+    run_matrix=np.empty([lval,lset+lmeas])
+    columns = [tree[param_names[j]] for j in set_params] + [param_data[param_names[k]][param_names[k]] for k in meas_params]
+    for colcounter, coldata in enumerate(columns):
+        coldata = np.ravel(coldata)[0:lval]
+        run_matrix[0:len(coldata),colcounter] = coldata
+        run_matrix[len(coldata):,colcounter] = np.nan
+    return run_matrix
+
+# Number of rows that _write_dat_rows formats and writes in one go
+_write_chunk_rows = 20000
+
+# Formats a column of a chunk with '%.18e' (the np.savetxt default format). Set axes repeat the same few values many
+# times, for those only the unique values (compared bitwise, so -0.0 and nan payloads stay exact) are formatted.
+def _format_column(column):
+    bits = column.view(np.int64)
+    unique_bits, inverse = np.unique(bits, return_inverse=True)
+    if len(unique_bits) > len(column)//2:
+        return np.array(['%.18e' % value for value in column.tolist()], dtype=object)
+    formatted = np.array(['%.18e' % value for value in unique_bits.view(np.float64).tolist()], dtype=object)
+    return formatted[inverse.ravel()]
+
+# Writes the rows of run_matrix to an open *.dat file and adds a newline on all slowaxes. previous_row is the last row
+# already present in the file (if any), so newlines also come out right when a run is written in several chunks.
+# The output is byte-identical to np.savetxt(f, rows, delimiter='\t') per slow axis slice, but whole chunks of rows
+# (including the newlines) are assembled with a single string format operation and written with one write call.
+def _write_dat_rows(f, run_matrix, lset, newline_slowaxes, previous_row=None, profile=None):
+    nrows, ncols = run_matrix.shape
+    if nrows == 0:
+        return
+    if profile is None:
+        profile = extraction_profile()
+    rowfmt = '\t'.join(['%s']*ncols) + '\n'
+    # Routine for finding the rows on which a slow axis changes (works for infinite dimensions)
+    with profile.phase('slow-axis slicing'):
+        newlines = np.array([]).astype(int)
+        if newline_slowaxes == True and lset > 1:
+            slowaxes = run_matrix[:,0:lset-1]
+            newlines = np.flatnonzero(np.any(slowaxes[:-1] != slowaxes[1:], axis=1)) + 1
+            if previous_row is not None and np.any(previous_row[0:lset-1] != slowaxes[0]):
+                newlines = np.concatenate(([0], newlines))
+
+    with profile.phase('text write'):
+        _write_dat_chunks(f, run_matrix, rowfmt, newlines)
+
+def _write_dat_chunks(f, run_matrix, rowfmt, newlines):
+    nrows, ncols = run_matrix.shape
+    for start in range(0, nrows, _write_chunk_rows):
+        stop = min(start + _write_chunk_rows, nrows)
+        chunk = np.ascontiguousarray(run_matrix[start:stop], dtype=np.float64)
+        values = np.empty((stop-start, ncols), dtype=object)
+        for col in range(0,ncols):
+            values[:,col] = _format_column(chunk[:,col].copy())
+        chunknewlines = newlines[(newlines >= start) & (newlines < stop)] - start
+        fmt = []
+        previous = 0
+        for row in chunknewlines:
+            fmt.append(rowfmt*(row-previous) + '\n')
+            previous = row
+        fmt.append(rowfmt*(stop-start-previous))
+        f.write((''.join(fmt) % tuple(values.ravel().tolist())).encode())
+
+# File extensions of the export formats, the binary formats are written next to or instead of the *.dat text files
+_format_extensions = {'dat': '.dat', 'dat.gz': '.dat.gz', 'dat.zst': '.dat.zst', 'npz': '.npz', 'hdf5': '.h5',
+                      'npy': '.npy', 'grid': '_grid.npz'}
+
+# Formats that need the full run matrix at once and cannot be written in chunks
+_unchunked_formats = ['npz', 'grid']
+
+# Returns the export formats as a list, format can be a single format or a list of formats
+def _export_formats(format):
+    if isinstance(format, str):
+        format = [format]
+    for fmt in format:
+        if fmt not in _format_extensions:
+            raise ValueError("Unknown export format '" + str(fmt) + "', choose from " + str(list(_format_extensions)))
+    return list(format)
+
+def _check_chunksize(format, chunksize):
+    for fmt in _export_formats(format):
+        if fmt in _unchunked_formats and chunksize is not None:
+            raise ValueError("Export format '" + fmt + "' needs the full run matrix and cannot be used with chunksize.")
+
+# Compression of the 'dat.gz' and 'dat.zst' formats. A compressed file is a gzip or zstd stream of one or more
+# members (frames) that decompresses to exactly the text of the *.dat file, so zcat/zstdcat and np.loadtxt (for .gz)
+# read it directly.
+_compression_levels = {'gz': 6, 'zst': 3}
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Export format 'dat.zst' requires the zstandard package.")
+    return zstandard
+
+# Streaming compressor around a new file, nothing uncompressed is written to disk
+def _compressed_file(fullpath, compression):
+    if compression == 'gz':
+        return gzip.open(fullpath, 'wb', compresslevel=_compression_levels['gz'])
+    compressor = _zstandard().ZstdCompressor(level=_compression_levels['zst'])
+    return compressor.stream_writer(open(fullpath, 'wb'), closefd=True)
+
+# Compresses data into a complete member (frame), which can be appended to a compressed file
+def _compressed_member(data, compression):
+    if compression == 'gz':
+        return gzip.compress(data, compresslevel=_compression_levels['gz'])
+    return _zstandard().ZstdCompressor(level=_compression_levels['zst']).compress(data)
+
+# Stores data uncompressed in a member (frame) whose length only depends on the length of data, so it can be
+# overwritten in place. Used for the header of a live export, whose number of values changes with every update.
+def _stored_member(data, compression):
+    if compression == 'gz':
+        return gzip.compress(data, compresslevel=0, mtime=0)
+    # zstd frame with the content size in 4 bytes and a single raw (uncompressed) block
+    return (b'\x28\xb5\x2f\xfd' + b'\xa0' + len(data).to_bytes(4, 'little')
+            + ((len(data) << 3) | 1).to_bytes(3, 'little') + data)
+
+# Writers of the export formats. Each writer is opened once per file, gets the run matrix in one or more chunks with
+# write(run_matrix, previous_row) and finishes the file with close(). The binary formats keep the header, names, labels
+# and units of the *.dat file as metadata: as extra arrays in the .npz file, as attributes of the 'data' dataset in the
+# .h5 file and in a .json file next to the .npy file. The .npy file holds the raw matrix only, so it can be opened with
+# np.load(path, mmap_mode='r').
+class _dat_writer:
+    _compression = None
+
+    def __init__(self, fullpath, header, parameters, set_params, meas_params, newline_slowaxes):
+        self._lset = len(set_params)
+        self._newline_slowaxes = newline_slowaxes
+        if self._compression is None:
+            self._f = open(fullpath, "wb")
+        else:
+            self._f = _compressed_file(fullpath, self._compression)
+        np.savetxt(self._f,np.array([]), header = header)
+
+    def write(self, run_matrix, previous_row=None, profile=None):
+        _write_dat_rows(self._f, run_matrix, self._lset, self._newline_slowaxes, previous_row, profile)
+
+    def close(self):
+        self._f.close()
+
+class _dat_gz_writer(_dat_writer):
+    _compression = 'gz'
+
+class _dat_zst_writer(_dat_writer):
+    _compression = 'zst'
+
+class _npz_writer:
+    def __init__(self, fullpath, header, parameters, set_params, meas_params, newline_slowaxes):
+        self._fullpath = fullpath
+        self._names, self._labels, self._units = _column_info(parameters, set_params, meas_params)
+        self._header = header
+        self._lset = len(set_params)
+        self._run_matrix = None
+
+    def write(self, run_matrix, previous_row=None):
+        if self._run_matrix is not None:
+            raise ValueError("Export format 'npz' needs the full run matrix and cannot be written in chunks.")
+        self._run_matrix = run_matrix
+
+    def close(self):
+        np.savez(self._fullpath, data=self._run_matrix, names=np.array(self._names), labels=np.array(self._labels),
+                 units=np.array(self._units), header=np.array(self._header), nset=np.array(self._lset))
+
+class _npy_writer:
+    # Room for the .npy header, the shape in the header is only known at the end and written in close()
+    _header_length = 128
+
+    def __init__(self, fullpath, header, parameters, set_params, meas_params, newline_slowaxes):
+        names, labels, units = _column_info(parameters, set_params, meas_params)
+        with open(os.path.splitext(fullpath)[0] + '.json', 'w') as f:
+            json.dump({'header': header, 'names': names, 'labels': labels, 'units': units, 'nset': len(set_params)}, f, indent = 4)
+        self._ncols = len(names)
+        self._nrows = 0
+        self._f = open(fullpath, "wb")
+        self._f.write(b' '*self._header_length)
+
+    def write(self, run_matrix, previous_row=None):
+        self._f.write(np.ascontiguousarray(run_matrix, dtype='<f8').tobytes())
+        self._nrows = self._nrows + len(run_matrix)
+
+    def close(self):
+        # Version 1.0 .npy header, padded with spaces to the reserved length
+        header = "{'descr': '<f8', 'fortran_order': False, 'shape': (" + str(self._nrows) + ", " + str(self._ncols) + "), }"
+        header = header.ljust(self._header_length - 10 - 1) + '\n'
+        self._f.seek(0)
+        self._f.write(np.lib.format.magic(1, 0) + np.uint16(len(header)).astype('<u2').tobytes() + header.encode('latin1'))
+        self._f.close()
+
+class _hdf5_writer:
+    def __init__(self, fullpath, header, parameters, set_params, meas_params, newline_slowaxes):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("Export format 'hdf5' requires the h5py package.")
+        names, labels, units = _column_info(parameters, set_params, meas_params)
+        self._f = h5py.File(fullpath, 'w')
+        self._dataset = self._f.create_dataset('data', shape=(0, len(names)), maxshape=(None, len(names)), dtype='f8', chunks=True)
+        self._dataset.attrs['header'] = header
+        self._dataset.attrs['names'] = names
+        self._dataset.attrs['labels'] = labels
+        self._dataset.attrs['units'] = units
+        self._dataset.attrs['nset'] = len(set_params)
+
+    def write(self, run_matrix, previous_row=None):
+        nrows = self._dataset.shape[0]
+        self._dataset.resize(nrows + len(run_matrix), axis=0)
+        self._dataset[nrows:,:] = run_matrix
+
+    def close(self):
+        self._f.close()
+
+# Dense N-d arrays, see gridding.py. The _grid.npz file holds an array per set param with the axis values and an array
+# per meas param with one dimension per set param (slowest axis first), stored under 'data/' and the parameter name, so
+# a map is loaded with np.load(path)['data/' + name] and no parameter name can collide with the metadata. Runs that are
+# no rectangular grid are stored as 1D columns under the same names, with gridded=False.
+class _grid_writer:
+    def __init__(self, fullpath, header, parameters, set_params, meas_params, newline_slowaxes):
+        self._fullpath = fullpath
+        self._names, self._labels, self._units = _column_info(parameters, set_params, meas_params)
+        self._header = header
+        self._lset = len(set_params)
+        self._run_matrix = None
+
+    def write(self, run_matrix, previous_row=None):
+        if self._run_matrix is not None:
+            raise ValueError("Export format 'grid' needs the full run matrix and cannot be written in chunks.")
+        self._run_matrix = run_matrix
+
+    def close(self):
+        grid = to_grid(self._run_matrix, self._lset)
+        if grid is None:
+            arrays = [self._run_matrix[:,k] for k in range(self._run_matrix.shape[1])]
+        else:
+            axes, meas_arrays = grid
+            arrays = axes + meas_arrays
+        data = dict(zip(['data/' + name for name in self._names], arrays))
+        np.savez(self._fullpath, names=np.array(self._names), labels=np.array(self._labels),
+                 units=np.array(self._units), header=np.array(self._header), nset=np.array(self._lset),
+                 gridded=np.array(grid is not None), **data)
+
+_format_writers = {'dat': _dat_writer, 'dat.gz': _dat_gz_writer, 'dat.zst': _dat_zst_writer, 'npz': _npz_writer,
+                   'hdf5': _hdf5_writer, 'npy': _npy_writer, 'grid': _grid_writer}
+
+# Reads the rows of a result_dict entry that come after the first rows_read database rows and yields them as run
+# matrices, together with the number of database rows they hold. With chunksize the rows are read in chunks of at most
+# chunksize database rows, otherwise all remaining rows are read at once. Only the rows that are present for all meas
+# params are taken, the others are read again with the next chunk (or with the next update of incremental_extractor).
+def _read_run_matrices(run, param_names, set_params, meas_params, chunksize=None, rows_read=0, profile=None):
+    names = [param_names[k] for k in meas_params]
+    if profile is None:
+        profile = extraction_profile()
+    while True:
+        with profile.phase('db read'):
+            if chunksize is None:
+                param_data = run.get_parameter_data(*names, start=rows_read+1)
+            else:
+                param_data = run.get_parameter_data(*names, start=rows_read+1, end=rows_read+chunksize)
+        nrows = min([len(param_data[name][name]) if name in param_data else 0 for name in names])
+        if nrows == 0:
+            return
+        with profile.phase('matrix build'):
+            for name in names:
+                for key in param_data[name]:
+                    param_data[name][key] = param_data[name][key][0:nrows]
+            run_matrix = _build_run_matrix(param_data, param_names, set_params, meas_params)
+        yield nrows, run_matrix
+        del param_data
+        rows_read = rows_read + nrows
+        if chunksize is None:
+            return
+
+# Saving of snapshot + run description to JSON file. Returns a list of warnings instead of printing them, so they can
+# be reported in a deterministic order when runs are extracted in parallel.
+def _write_snapshot_json(run, runid, fullpathjson, snapshot_store=None):
+    messages = []
+    total_json = {}
+    if run.snapshot and run.description:
+        total_json = {**json.loads(sz.to_json_for_storage(run.description)), **run.snapshot}
+    if not run.snapshot:
+        if run.description:
+            total_json = {**json.loads(sz.to_json_for_storage(run.description))}
+            messages.append(f'Warning: Measurement {runid} has no snapshot.')
+        else:
+            messages.append(f'Warning: Measurement {runid} has no snapshot or run description. Axes for plotting cannot be extracted.')
+    if snapshot_store is not None and 'instruments' in total_json.get('station', {}):
+        instruments = {}
+        for name, instrument in total_json['station']['instruments'].items():
+            instruments[name] = {'snapshot_ref': _store_snapshot_part(snapshot_store, instrument)}
+        total_json['station'] = {**total_json['station'], 'instruments': instruments}
+        total_json['snapshot_store'] = os.path.relpath(snapshot_store, os.path.dirname(fullpathjson))
+    _write_if_changed(fullpathjson, json.dumps(total_json, indent = 4))
+    return messages
+
+# Writes text to path, unless the file already holds exactly this text. Returns whether the file was written.
+def _write_if_changed(path, text):
+    if os.path.isfile(path):
+        with open(path, 'r') as f:
+            if f.read() == text:
+                return False
+    with open(path, 'w') as f:
+        f.write(text)
+    return True
+
+# Folder of the content-addressed snapshot store in the extraction folder, see snapshot_store in db_extractor
+_snapshot_store_folder = 'snapshots'
+
+def _snapshot_store_path(dbpath):
+    return os.path.join(dbpath.split('.')[0], _snapshot_store_folder)
+
+# Stores part of a snapshot under the sha256 hash of its content and returns the hash. A part that is already in the
+# store is not written again. Written through a temporary file, as workers of db_extractor_batch share the store.
+def _store_snapshot_part(snapshot_store, part):
+    text = json.dumps(part, indent = 4, sort_keys = True)
+    key = hashlib.sha256(text.encode()).hexdigest()
+    path = os.path.join(snapshot_store, key + '.json')
+    if not os.path.isfile(path):
+        if not os.path.exists(snapshot_store):
+            os.makedirs(snapshot_store, exist_ok=True)
+        tmppath = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmppath, 'w') as f:
+            f.write(text)
+        os.replace(tmppath, path)
+    return key
+
+# Loads a run_snapshot.json as written by db_extractor. With snapshot_store the instrument snapshots are references
+# into the store, these are replaced by the stored instrument snapshots, so the result is the same in both cases.
+def load_run_snapshot(fullpathjson):
+    with open(fullpathjson, 'r') as f:
+        total_json = json.load(f)
+    if 'snapshot_store' in total_json:
+        snapshot_store = os.path.join(os.path.dirname(fullpathjson), total_json.pop('snapshot_store'))
+        instruments = {}
+        for name, ref in total_json['station']['instruments'].items():
+            with open(os.path.join(snapshot_store, ref['snapshot_ref'] + '.json'), 'r') as f:
+                instruments[name] = json.load(f)
+        total_json['station']['instruments'] = instruments
+    return total_json
+
+# Yields the runs to extract. Requested run ids are loaded directly by their id, so the time this takes scales with
+# the number of requested runs and not with the size of the database. If no ids are given all runs of all exps are loaded.
+def _runs_to_extract(ids, suppress_output, conn=None):
+    if len(ids) > 0:
+        for runid in sorted(set(int(runid) for runid in ids)):
+            try:
+                run = qc.load_by_id(runid, conn=conn)
+            except ValueError:
+                if not suppress_output:
+                    print('Run with id ' + str(runid) + ' not found in database, skipping.')
+                continue
+            yield run
+    else:
+        for i in range(1,len(qc.dataset.experiment_container.experiments(conn=conn))+1,1):
+            exp = qc.load_experiment(i, conn=conn)
+            for j in range(1,exp.last_counter+1):
+                yield exp.data_set(j)
+
+# Returns the ids of the runs to extract in the same order as _runs_to_extract, from a single query on the runs table
+def _run_ids_to_extract(ids, suppress_output, conn):
+    rows = conn.execute('SELECT run_id FROM runs ORDER BY exp_id, result_counter').fetchall()
+    all_ids = [row[0] for row in rows]
+    if len(ids) == 0:
+        return all_ids
+    run_ids = []
+    for runid in sorted(set(int(runid) for runid in ids)):
+        if runid in all_ids:
+            run_ids.append(runid)
+        elif not suppress_output:
+            print('Run with id ' + str(runid) + ' not found in database, skipping.')
+    return run_ids
+
+class extraction_profile:
+    '''
+    Timing profile of an extraction job. The time spent in every phase of the extraction is added up over all runs,
+    for the whole job and per run, so it shows where the export time goes on a given database:
+
+    experiment scan     finding and loading the runs in the database
+    parameter metadata  parameters, dependencies, file names and headers of a run
+    db read             reading the data from the database
+    matrix build        collecting the set and meas columns into the run matrix
+    slow-axis slicing   finding the rows on which a slow axis changes, for the newlines in the *.dat files
+    text write          formatting and (compressing and) writing the *.dat files
+    binary write        writing the npz, npy, hdf5 and grid files
+    snapshot write      writing run_snapshot.json
+
+    Pass an extraction_profile to db_extractor or db_extractor_batch (profile=...) to collect the timings of a job,
+    with checktimes=True the profile is printed at the end. to_dict() and dump(path) give the profile as JSON, profiles
+    of several jobs are added up with merge(). With parallel extraction the phases add up the time of all workers, so
+    their sum can be larger than wall_seconds, the duration of the job.
+    '''
+    phases = ['experiment scan', 'parameter metadata', 'db read', 'matrix build', 'slow-axis slicing', 'text write',
+              'binary write', 'snapshot write']
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.runs = {} # Per run id the seconds per phase
+        self.wall_seconds = 0
+        self.runid = None # Run the timed phases are counted for
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.runid is not None:
+            run = self.runs.setdefault(str(self.runid), {})
+            run[name] = run.get(name, 0) + seconds
+
+    # Adds the timings of another profile (or of its to_dict()) to this one
+    def merge(self, other):
+        if isinstance(other, extraction_profile):
+            other = other.to_dict()
+        for name, phase in other['phases'].items():
+            self.seconds[name] = self.seconds.get(name, 0) + phase['seconds']
+            self.calls[name] = self.calls.get(name, 0) + phase['calls']
+        for runid, run in other['runs'].items():
+            for name, seconds in run.items():
+                self.runs.setdefault(runid, {})
+                self.runs[runid][name] = self.runs[runid].get(name, 0) + seconds
+        self.wall_seconds = self.wall_seconds + other['wall_seconds']
+
+    def to_dict(self):
+        names = [name for name in self.phases if name in self.seconds]
+        names += [name for name in self.seconds if name not in self.phases]
+        return {'wall_seconds': self.wall_seconds,
+                'phases': {name: {'seconds': self.seconds[name], 'calls': self.calls[name]} for name in names},
+                'runs': self.runs}
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent = 4)
+
+    def report(self):
+        total = sum(self.seconds.values())
+        lines = ['{:<20}{:>12}{:>8}{:>10}'.format('phase', 'seconds', '%', 'calls')]
+        for name, phase in self.to_dict()['phases'].items():
+            percentage = 100*phase['seconds']/total if total > 0 else 0
+            lines.append('{:<20}{:>12.4f}{:>8.1f}{:>10}'.format(name, phase['seconds'], percentage, phase['calls']))
+        lines.append('{:<20}{:>12.4f}'.format('total', total))
+        lines.append('{:<20}{:>12.4f}'.format('wall', self.wall_seconds))
+        return '\n'.join(lines)
+
+# Yields the items of iterable and adds the time spent in getting each of them to phase name of profile
+def _timed(iterable, profile, name):
+    iterator = iter(iterable)
+    while True:
+        with profile.phase(name):
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+# Extracts all *.dat files and the snapshot of a single run. Returns a dict with the run id, the files that were written
+# and the messages for the user, which are printed by db_extractor. The timings are added to profile.
+def _extract_run(run, dbpath, overwrite, timestamp, paramtofilename, newline_slowaxes, no_folders, suppress_output,
+                 profile, format='dat', chunksize=None, snapshot_store=False):
+    runid = run.run_id
+    expname = run.exp_name
+    samplename = run.sample_name
+    result = {'run_id': runid, 'files': [], 'messages': []}
+    profile.runid = runid
+
+    #Loadin a new run
+    if run.number_of_results > 0:
+
+        with profile.phase('parameter metadata'):
+            parameters, param_names, result_dict, depend_dict = _run_structure(run)
+            #Length of final result_dict determines number of files
+            folder, fullpaths, fullpathjson = _run_filepaths(run, runid, run.exp_id, expname, samplename, dbpath, len(result_dict),
+                                                             timestamp, paramtofilename, no_folders)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        all_param_data = None # Read from db only once per run, shared by all files of the run
+        for n in range(0,len(result_dict)): # len(result_dict) gives number of independent measurement, i.e. .dat files
+            fullpath = fullpaths[n]
+            formatpaths = [(fmt, os.path.splitext(fullpath)[0] + _format_extensions[fmt]) for fmt in _export_formats(format)]
+
+            #Check if file exists already
+            if all([os.path.isfile(path) for fmt, path in formatpaths]) and overwrite == False:
+                #print('File found, skipping extraction')
+                pass
+            else:
+                meas_params = result_dict[n] # Collect measurement params
+                set_params = depend_dict[n]  # Collect depend params
+
+                #Construct dat file header
+                with profile.phase('parameter metadata'):
+                    header = _dat_header(run, runid, expname, samplename, parameters, set_params, meas_params, run.number_of_results)
+
+                if chunksize is None:
+                    if all_param_data is None:
+                        with profile.phase('db read'):
+                            all_param_data = run.get_parameter_data()
+                    # Pre-allocate data array and collect set and meas columns, written as a single chunk
+                    with profile.phase('matrix build'):
+                        chunks = [(None, _build_run_matrix(all_param_data, param_names, set_params, meas_params))]
+                else:
+                    # Streaming: each chunk is read, written to all files and freed before the next one is read
+                    chunks = _read_run_matrices(run, param_names, set_params, meas_params, chunksize, profile=profile)
+
+                _check_chunksize(format, chunksize)
+                writers = []
+                for fmt, path in formatpaths:
+                    # Confirming function is a good boy
+                    if not suppress_output:
+                        result['messages'].append("Saving measurement with id " + str(runid) +  " to  "+ path)
+                    writers.append(_format_writers[fmt](path, header, parameters, set_params, meas_params, newline_slowaxes))
+                    result['files'].append(path)
+
+                previous_row = None
+                for nrows, run_matrix in chunks:
+                    for writer in writers:
+                        if isinstance(writer, _dat_writer):
+                            writer.write(run_matrix, previous_row, profile)
+                        else:
+                            with profile.phase('binary write'):
+                                writer.write(run_matrix, previous_row)
+                    previous_row = run_matrix[-1,:].copy()
+                    del run_matrix
+                for writer in writers:
+                    with profile.phase('text write' if isinstance(writer, _dat_writer) else 'binary write'):
+                        writer.close()
+
+                with profile.phase('snapshot write'):
+                    if snapshot_store:
+                        result['messages'] += _write_snapshot_json(run, runid, fullpathjson, _snapshot_store_path(dbpath))
+                    else:
+                        result['messages'] += _write_snapshot_json(run, runid, fullpathjson)
+    profile.runid = None
+    return result
+
+# Name of the manifest in the extraction folder, which records per run the state of the run and the files that were
+# written for it. See manifest in db_extractor.
+_manifest_filename = 'extraction_manifest.json'
+
+def _manifest_path(dbpath):
+    return os.path.join(dbpath.split('.')[0], _manifest_filename)
+
+def _load_manifest(manifestpath):
+    if os.path.isfile(manifestpath):
+        with open(manifestpath, 'r') as f:
+            return json.load(f)
+    return {}
+
+# The manifest is written to a temporary file first, so an interrupted extraction never leaves a broken manifest
+def _save_manifest(manifestpath, manifest):
+    if not os.path.exists(os.path.dirname(manifestpath)):
+        os.makedirs(os.path.dirname(manifestpath))
+    with open(manifestpath + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent = 4)
+    os.replace(manifestpath + '.tmp', manifestpath)
+
+# Options of db_extractor that change the extracted files, a run is extracted again when these differ from the manifest
+def _manifest_options(timestamp, paramtofilename, newline_slowaxes, no_folders, format):
+    return {'timestamp': timestamp, 'paramtofilename': paramtofilename, 'newline_slowaxes': newline_slowaxes,
+            'no_folders': no_folders, 'format': _export_formats(format)}
+
+def _run_state(run):
+    return {'number_of_results': run.number_of_results, 'completed': bool(run.completed)}
+
+# A run is up to date when it did not grow or complete since it was extracted, and all its files still exist
+def _manifest_up_to_date(entry, state, options):
+    if entry is None:
+        return False
+    return (entry['number_of_results'] == state['number_of_results'] and entry['completed'] == state['completed']
+            and entry['options'] == options and all([os.path.isfile(path) for path in entry['files']]))
+
+# Runs in the worker processes of db_extractor_batch. Every worker process reads through its own read-only connection.
+# The timings of the run are sent back with the result, as the profile of the job lives in the main process.
+def _extract_run_worker(task):
+    dbloc, runid, dbpath, options = task
+    options = dict(options)
+    del options['checktimes']
+    profile = extraction_profile()
+    conn = _readonly_connection(dbloc)
+    with profile.phase('experiment scan'):
+        run = qc.load_by_id(runid, conn=conn)
+    result = _extract_run(run, dbpath, profile=profile, **options)
+    conn.close()
+    result['profile'] = profile.to_dict()
+    return result
 
 # Extract *.db file into conventient folder structure with proper naming. Extracts measurement snapshots if available
 
@@ -19,275 +766,372 @@ import datetime
 # newline_slowaxes: Adds a newline on all slowaxes, works in infinte dimensions, i.e., cube measurements and higher. Default: True
 # no_folders: Creation of folders is supressed. All measurements are put in the same folder with their measurement IDs.
 # suppress_output: Suppresses all print commands
-def db_extractor(dbloc=None, 
-                 extractpath=None, 
+# useopendbconnection: Extract from the database that is currently opened in qc.config, dbloc is then only used for
+#                      the extraction path. Default: False
+# readonly: Read through a read-only connection to dbloc, which is closed at the end. qc.config and the opened database are left alone, so
+#           this is fast and safe to use next to a running measurement. Default: False
+# workers: Number of processes the runs are spread over, see db_extractor_batch. Default: 1
+# format: Export format, or list of formats, of the files per run. 'dat' (tab separated text), 'dat.gz' or 'dat.zst'
+#         (the same text, compressed while it is written, 'dat.zst' needs zstandard), 'npz', 'hdf5' (needs h5py),
+#         'npy' (raw matrix that can be opened with np.load(mmap_mode='r'), metadata in a .json file next to it) or
+#         'grid' (_grid.npz with a dense N-d array per meas param and the axis values per set param, meandered rows
+#         un-reversed). The binary formats keep the header, names, labels and units as metadata. Default: 'dat'
+# chunksize: Streaming extraction for runs larger than RAM. The run is read from the database in chunks of at most
+#            chunksize rows, which are written to the files and freed before the next chunk is read, so the memory use
+#            does not depend on the size of the run. Not possible for formats 'npz' and 'grid'. Default: None (read run at once)
+# manifest: Keep a manifest (extraction_manifest.json in the extraction folder) with the number of results, completion
+#           state and written files of every run. Runs that did not change since they were extracted are skipped, new
+#           runs and runs that grew or completed are (re)extracted. With overwrite=True all runs are extracted again.
+#           Default: False
+# snapshot_store: Store the snapshot of every instrument once, under the hash of its content, in the folder snapshots
+#                 in the extraction folder. run_snapshot.json then refers to the stored instrument snapshots instead of
+#                 holding them, use load_run_snapshot to read it back complete. Default: False (full run_snapshot.json)
+#                 In both cases run_snapshot.json is only rewritten when its content changed.
+# profile: extraction_profile that collects the time spent in every phase of the extraction, see extraction_profile.
+#          Default: None
+# checktimes: Print the timing profile of the extraction at the end. Default: False
+# Returns a list with a dict per run: {'run_id': ..., 'files': [written files], 'messages': [...]}
+def db_extractor(dbloc=None,
+                 extractpath=None,
                  ids = [],
                  overwrite = False,
-                 timestamp = True, 
+                 timestamp = True,
                  paramtofilename = False,
                  newline_slowaxes = True,
                  no_folders = False,
                  suppress_output = False,
                  useopendbconnection = False,
-                 checktimes = False): # Only for debugging purposes
+                 readonly = False,
+                 workers = 1,
+                 format = 'dat',
+                 chunksize = None,
+                 manifest = False,
+                 snapshot_store = False,
+                 profile = None,
+                 checktimes = False):
+
 
-    
     if not suppress_output:
         if os.path.isfile(dbloc) and dbloc.endswith('.db'):
             print('*.db file found, continue to unpack...')
         else:
             print('*.db file location cannot be found..')
             return;
-    
-    if useopendbconnection == False:
+    # Check for unknown formats before extracting anything
+    _check_chunksize(format, chunksize)
+
+    if workers is None or workers > 1:
+        return db_extractor_batch([dict(dbloc=dbloc,
+                                        extractpath=extractpath,
+                                        ids=ids,
+                                        overwrite=overwrite,
+                                        timestamp=timestamp,
+                                        paramtofilename=paramtofilename,
+                                        newline_slowaxes=newline_slowaxes,
+                                        no_folders=no_folders,
+                                        suppress_output=suppress_output,
+                                        format=format,
+                                        chunksize=chunksize,
+                                        manifest=manifest,
+                                        snapshot_store=snapshot_store,
+                                        checktimes=checktimes)], workers=workers, profile=profile)[0]
+
+    conn = None
+    if readonly == True:
+        conn = _readonly_connection(dbloc)
+    elif useopendbconnection == False:
         configuration = qc.config
         previously_opened_db = configuration['core']['db_location']
         configuration['core']['db_location'] = dbloc
         configuration.save_to_home()
         initialise_database()
- 
-    starttime = datetime.datetime.now()
-
-    times = []
-    times.append(datetime.datetime.now())
-    #Looping through all exps inside database
-    for i in range(1,len(qc.dataset.experiment_container.experiments())+1,1):
-        #print('Expid:',i)
-        exp = qc.load_experiment(i)
-        expname = exp.name
-        samplename = exp.sample_name
-        folderstring = f'Exp' + '{:02d}'.format(i) + f'({expname})' + '-Sample' + f'({samplename})'
-        nmeas = exp.last_counter
+
+    if profile is None:
+        profile = extraction_profile()
+    starttime = time.perf_counter()
+    if extractpath != None:
+        dbpath = os.path.abspath(extractpath)
+    else:
+        dbpath = os.path.abspath(dbloc)
+
+    if manifest:
+        manifestpath = _manifest_path(dbpath)
+        manifest_data = _load_manifest(manifestpath)
+        options = _manifest_options(timestamp, paramtofilename, newline_slowaxes, no_folders, format)
+
+    results = []
+    #Looping through the requested runs, or through all runs of all exps inside database
+    for run in _timed(_runs_to_extract(ids, suppress_output, conn), profile, 'experiment scan'):
+        if manifest:
+            state = _run_state(run)
+            if overwrite == False and _manifest_up_to_date(manifest_data.get(str(run.run_id)), state, options):
+                results.append({'run_id': run.run_id, 'files': [], 'messages': []})
+                continue
+        result = _extract_run(run, dbpath, overwrite or manifest, timestamp, paramtofilename, newline_slowaxes, no_folders,
+                              suppress_output, profile, format, chunksize, snapshot_store)
+        for message in result['messages']:
+            print(message)
+        results.append(result)
+        if manifest:
+            manifest_data[str(run.run_id)] = {**state, 'files': result['files'], 'options': options}
+    if manifest:
+        _save_manifest(manifestpath, manifest_data)
+
+    if conn is not None:
+        conn.close()
+    if readonly == False and useopendbconnection == False:
+        configuration['core']['db_location'] = previously_opened_db
+        configuration.save_to_home()
+        initialise_database()
+    profile.wall_seconds = profile.wall_seconds + time.perf_counter() - starttime
+    if checktimes:
+        print(profile.report())
+    return results
+
+def db_extractor_batch(jobs, workers=None, profile=None):
+    """
+    Extracts the runs of one or more databases in parallel on a process pool. Most of the extraction time is spent on
+    formatting the text files, which is CPU-bound, so the throughput scales with the number of cores.
+
+    jobs: list of dicts with the keyword arguments of db_extractor, one per database (dbloc, extractpath, ids, overwrite,
+          timestamp, paramtofilename, newline_slowaxes, no_folders, suppress_output, format, chunksize, manifest,
+          snapshot_store, checktimes)
+    workers: number of worker processes, None uses the number of cores
+    profile: extraction_profile that collects the timings of all jobs, the timings of the workers are added to it
+
+    Every worker reads through its own read-only connection, see readonly in db_extractor, so qc.config is left alone.
+    Messages and warnings are printed in run order after each run is done, independent of which worker finished first.
+    Returns a list with the results (see db_extractor) of every job, in the order of jobs and runs.
+    """
+    if profile is None:
+        profile = extraction_profile()
+    starttime = time.perf_counter()
+    checktimes = False
+    tasks = []
+    job_infos = []
+    for job in jobs:
+        job = dict(job)
+        dbloc = os.path.abspath(job.pop('dbloc'))
+        extractpath = job.pop('extractpath', None)
+        ids = job.pop('ids', [])
+        manifest = job.pop('manifest', False)
+        if extractpath != None:
+            dbpath = os.path.abspath(extractpath)
+        else:
+            dbpath = dbloc
+        options = dict(overwrite=False, timestamp=True, paramtofilename=False, newline_slowaxes=True, no_folders=False,
+                       suppress_output=False, format='dat', chunksize=None, snapshot_store=False, checktimes=False)
+        options.update(job)
+        checktimes = checktimes or options['checktimes']
+        conn = _readonly_connection(dbloc)
+        with profile.phase('experiment scan'):
+            run_ids = _run_ids_to_extract(ids, options['suppress_output'], conn)
+
+        # With a manifest the unchanged runs are skipped here, before anything is sent to the workers
+        job_info = {'run_ids': run_ids, 'tasks': [], 'manifest': manifest}
+        if manifest:
+            job_info['manifestpath'] = _manifest_path(dbpath)
+            job_info['manifest_data'] = _load_manifest(job_info['manifestpath'])
+            job_info['options'] = _manifest_options(options['timestamp'], options['paramtofilename'],
+                                                    options['newline_slowaxes'], options['no_folders'], options['format'])
+            job_info['states'] = {}
+        for runid in run_ids:
+            if manifest:
+                with profile.phase('experiment scan'):
+                    state = _run_state(qc.load_by_id(runid, conn=conn))
+                job_info['states'][runid] = state
+                entry = job_info['manifest_data'].get(str(runid))
+                if options['overwrite'] == False and _manifest_up_to_date(entry, state, job_info['options']):
+                    job_info['tasks'].append(None)
+                    continue
+                tasks.append((dbloc, runid, dbpath, {**options, 'overwrite': True}))
+            else:
+                tasks.append((dbloc, runid, dbpath, options))
+            job_info['tasks'].append(len(tasks)-1)
+        job_infos.append(job_info)
+        conn.close()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map returns the results in the order of the tasks
+        results = []
+        for result in executor.map(_extract_run_worker, tasks):
+            profile.merge(result.pop('profile'))
+            for message in result['messages']:
+                print(message)
+            results.append(result)
+
+    job_results = []
+    for job_info in job_infos:
+        job_result = []
+        for runid, task in zip(job_info['run_ids'], job_info['tasks']):
+            if task is None:
+                job_result.append({'run_id': runid, 'files': [], 'messages': []})
+                continue
+            job_result.append(results[task])
+            if job_info['manifest']:
+                job_info['manifest_data'][str(runid)] = {**job_info['states'][runid], 'files': results[task]['files'],
+                                                         'options': job_info['options']}
+        if job_info['manifest']:
+            _save_manifest(job_info['manifestpath'], job_info['manifest_data'])
+        job_results.append(job_result)
+    profile.wall_seconds = profile.wall_seconds + time.perf_counter() - starttime
+    if checktimes:
+        print(profile.report())
+    return job_results
+
+class incremental_extractor:
+    '''
+    Append-only export of a single (running) measurement to *.dat files, using the same folder structure, file names
+    and header as db_extractor. Every call of update() reads only the rows that were added to the database since the
+    previous call and appends them to the open *.dat files, so the cost of a live export does not grow with the length
+    of the run. Newlines on the slow axes also come out right across the boundaries of the appended chunks.
+
+    The "Number of values" in the header is overwritten in place on every update. close() closes the *.dat files and the
+    read-only connection, for a completed run it also removes the padding after the number of values, so the files are
+    then the same as those written by db_extractor.
+    By default the run is read through a read-only connection to dbloc (see readonly in db_extractor), if readonly is
+    False the database opened in qc.config is used. The remaining arguments are the same as for db_extractor.
+
+    With format 'dat.gz' or 'dat.zst' every update appends the new rows as a separate compressed member (frame), so
+    the file is a complete compressed stream after every update. The header is kept in an uncompressed member of fixed
+    length at the start of the file, where the number of values is overwritten.
+    '''
+    def __init__(self,
+                 dbloc,
+                 runid,
+                 extractpath=None,
+                 timestamp=True,
+                 paramtofilename=False,
+                 newline_slowaxes=True,
+                 no_folders=False,
+                 suppress_output=True,
+                 readonly=True,
+                 snapshot_store=False,
+                 format='dat'):
+        if format not in ['dat', 'dat.gz', 'dat.zst']:
+            raise ValueError("incremental_extractor writes format 'dat', 'dat.gz' or 'dat.zst', not '" + str(format) + "'")
+        self._compression = _format_writers[format]._compression
+        self.runid = runid
+        self._conn = None # Read-only connection of the extractor, closed by close()
+        if readonly:
+            self._conn = _readonly_connection(dbloc)
+            self.run = qc.load_by_id(runid, conn=self._conn)
+        else:
+            self.run = qc.load_by_id(runid)
+        self._newline_slowaxes = newline_slowaxes
+        self._suppress_output = suppress_output
         if extractpath != None:
             dbpath = os.path.abspath(extractpath)
         else:
             dbpath = os.path.abspath(dbloc)
-        #Looping through all runs inside experiment
-        if checktimes:
-            times.append(datetime.datetime.now())
-            print('Loaded db and exp ',times[-1]-times[-2])
-        for j in range(1,nmeas+1):
-            run = exp.data_set(j)
-            runid = run.run_id
-            #print('Runid',runid)
-            runname = run.name
-            
-            #Loadin a new run
-            if (not ids or runid in ids) and (run.number_of_results > 0):
-            
-                # Adding optional file folder settings
-                if timestamp:
-                    timestampcut = str(run.run_timestamp()).replace(":", "").replace("-", "").replace(" ","-")
-                else:
-                    timestampcut = ''
-                
-                if paramtofilename:
-                    runparams = '_' + run.parameters
+        if snapshot_store:
+            self._snapshot_store = _snapshot_store_path(dbpath)
+        else:
+            self._snapshot_store = None
+        self._parameters, self._param_names, self._result_dict, self._depend_dict = _run_structure(self.run)
+        self._folder, self._fullpaths, self._fullpathjson = _run_filepaths(self.run, runid, self.run.exp_id, self.run.exp_name,
+                                                                           self.run.sample_name, dbpath, len(self._result_dict),
+                                                                           timestamp, paramtofilename, no_folders)
+        self._fullpaths = [os.path.splitext(path)[0] + _format_extensions[format] for path in self._fullpaths]
+        nfiles = len(self._result_dict)
+        self._files = [None]*nfiles
+        self._valuesoffset = [None]*nfiles # Position of the "Number of values" in the header of each file
+        self._rows_read = [0]*nfiles # Number of database rows already written to each file
+        self._last_row = [None]*nfiles # Last row written to each file, used for the slow axes newlines
+        self._headers = [None]*nfiles # Uncompressed headers of the compressed files
+        self._headerlength = [None]*nfiles # Length in bytes of the header (member) at the start of each file
+        self._number_of_values = None # Number of values written in the headers by the last update
+
+    # Opens the *.dat file of result_dict entry n and writes its header, with room for the growing number of values
+    def _open(self, n):
+        if not os.path.exists(self._folder):
+            os.makedirs(self._folder)
+        header = _dat_header(self.run, self.runid, self.run.exp_name, self.run.sample_name, self._parameters,
+                             self._depend_dict[n], self._result_dict[n], ' '*20)
+        if not self._suppress_output:
+            print("Saving measurement with id " + str(self.runid) +  " to  "+ self._fullpaths[n])
+        f = open(self._fullpaths[n], "wb")
+        self._valuesoffset[n] = len(('# ' + header.split('\n')[0]).encode()) - 20
+        if self._compression is None:
+            np.savetxt(f,np.array([]), header = header)
+        else:
+            self._headers[n] = io.BytesIO()
+            np.savetxt(self._headers[n],np.array([]), header = header)
+            f.write(_stored_member(self._headers[n].getvalue(), self._compression))
+        self._headerlength[n] = f.tell()
+        self._files[n] = f
+        for message in _write_snapshot_json(self.run, self.runid, self._fullpathjson, self._snapshot_store):
+            print(message)
+
+    # Reads the new rows of all result_dict entries from the database and appends them to the *.dat files.
+    # Returns the total number of rows (i.e. lines in the *.dat files) that were added.
+    def update(self):
+        nwritten = 0
+        number_of_values = self.run.number_of_results
+        self._number_of_values = number_of_values
+        for n in range(0,len(self._result_dict)):
+            meas_params = self._result_dict[n]
+            set_params = self._depend_dict[n]
+            if self._files[n] is None:
+                self._open(n)
+            f = self._files[n]
+            if self._compression is None:
+                rows = f
+            else:
+                rows = io.BytesIO()
+            for nrows, run_matrix in _read_run_matrices(self.run, self._param_names, set_params, meas_params,
+                                                        rows_read=self._rows_read[n]):
+                _write_dat_rows(rows, run_matrix, len(set_params), self._newline_slowaxes, self._last_row[n])
+                self._rows_read[n] = self._rows_read[n] + nrows
+                self._last_row[n] = run_matrix[-1,:]
+                nwritten = nwritten + len(run_matrix)
+            # Update the number of values in the header and return to the end of the file
+            if self._compression is None:
+                f.seek(self._valuesoffset[n])
+                f.write(str(number_of_values).ljust(20).encode())
+            else:
+                if rows.tell() > 0:
+                    f.write(_compressed_member(rows.getvalue(), self._compression))
+                self._headers[n].seek(self._valuesoffset[n])
+                self._headers[n].write(str(number_of_values).ljust(20).encode())
+                f.seek(0)
+                f.write(_stored_member(self._headers[n].getvalue(), self._compression))
+            f.seek(0, os.SEEK_END)
+            f.flush()
+        return nwritten
+
+    # Rewrites file n with the padding of the "Number of values" removed from the header, the header of a compressed
+    # file becomes a compressed member as well. The rows are copied without being parsed.
+    def _trim_header(self, n):
+        path = self._fullpaths[n]
+        start = self._valuesoffset[n]
+        with open(path, 'rb') as f:
+            if self._compression is None:
+                header = f.read(self._headerlength[n])
+            else:
+                header = self._headers[n].getvalue()
+                f.seek(self._headerlength[n])
+            header = header[:start] + str(self._number_of_values).encode() + header[start+20:]
+            with open(path + '.tmp', 'wb') as g:
+                if self._compression is None:
+                    g.write(header)
                 else:
-                    runparams = ''                
-                
-                parameters = run.get_parameters()
-                num_of_parameters = len(parameters)
-               
-                # Getting info on parameters used in the run
-                meas_params = []
-                param_names = [[]] * num_of_parameters
-                depends = [[]] * num_of_parameters
-                for k in range(0,num_of_parameters):                           
-                    param_names[k] = parameters[k].name
-                    if parameters[k].depends_on: #Check if measure parameter (i.e. if it has depends), then collect
-                        depends[k] = parameters[k].depends_on
-                        meas_params.append(k)
-                    
-                #Compare depends of meas_params and prepare two dicts which describes how the datasaver should process the run
-                result_dict = {} # Meas axes dict, rows are independent measurements, values per row are dependent measurements
-                depend_dict = {} # Depends (i.e. set axes) belonging to the measurements in the same column of above dict.
-                
-                n = 0
-                #Filling the dicts:
-                for l in meas_params: 
-                    params_with_equal_depends = [i for i, e in enumerate(depends) if e == depends[l]]
-                    if params_with_equal_depends not in result_dict.values():
-                    #if 1 == 1: #comment this line and uncomment above line
-                        result_dict.update([(n, params_with_equal_depends)])
-                        deps = parameters[l].depends_on #Split dependecy string
-                        deps = deps.split(', ')
-                        depsind = []
-                        for o in range(0,len(deps)):
-                            depsind.append(param_names.index(deps[o]))
-                        depend_dict.update([(n, depsind)])
-                        n = n + 1
-                if checktimes:
-                    times.append(datetime.datetime.now())
-                    print('Determined meas and set params ',times[-1]-times[-2])
-                #Length of final result_dict determines number of files
-                n=0                 
-                for i in range(0,len(result_dict)): # len(result_dict) gives number of independent measurement, i.e. .dat files
-                    
-                    #If number of files > 1, add a number in front
-                    if len(result_dict) > 1:
-                        filenamep2 = str(n) + "_" + run.name + runparams + ".dat"
-                        filenamejson = "run_snapshot.json"
-                    else:
-                        filenamep2 = run.name + "_" + runparams + ".dat"
-                        filenamejson = "run_snapshot.json"
-                    
-                    #Constructing final filepath
-                    filenamep1 = "{:03d}".format(runid) + '_' + timestampcut + '_' + run.name 
-                    if no_folders == True:
-                        #If number of files > 1, add a number in front
-                        if len(result_dict) > 1:
-                            filenamep2 = '{:03d}'.format(runid) + '-' + str(n) + "_" + run.name + runparams + ".dat"
-                            filenamejson = '{:03d}'.format(runid) + '-' + "run_snapshot.json"
-                        else:
-                            filenamep2 = '{:03d}'.format(runid) + '-' + run.name + runparams + ".dat"
-                            filenamejson = '{:03d}'.format(runid) + '-' + "run_snapshot.json"
-                        folder = (dbpath.split('.')[0])
-                    else:
-                        #If number of files > 1, add a number in front
-                        if len(result_dict) > 1:
-                            filenamep2 = str(n) + "_" + run.name + runparams + ".dat"
-                            filenamejson = "run_snapshot.json"
-                        else:
-                            filenamep2 = run.name + runparams + ".dat"
-                            filenamejson = "run_snapshot.json"
-                        folder = os.path.join((dbpath.split('.')[0]),folderstring,filenamep1)
-                    
-                    #folder = folder.replace(" ", "_").replace('?','_')
-                    folder = folder.replace('?','_')
-                    filenamep2 = filenamep2.replace(" ", "_").replace('?','_')
-                    filenamejson = filenamejson.replace(" ", "_").replace('?','_')
-                    fullpath = os.path.join(folder,filenamep2)
-                    fullpathjson = os.path.join(folder,filenamejson)
-                    if not os.path.exists(folder):
-                        os.makedirs(folder) 
-
-                    if checktimes:
-                        times.append(datetime.datetime.now())
-                        print('Constructing file and folder names ' ,times[-1]-times[-2])
-                    
-                    #Check if file exists already
-                    if os.path.isfile(fullpath) and overwrite == False:
-                        #print('File found, skipping extraction')
-                        pass
-                    else:
-                        #Construct dat file header                     
-                        header = ''
-                        header += f"Run #{runid}: {runname}, Experiment: {expname}, Sample name: {samplename}, Number of values: " + str(run.number_of_results) + "\n"
-                        try:
-                            comment = run.get_metadata('Comment')
-                            header += f"Comment: {comment} \n"
-                        except:
-                            header += "\n"
-                        
-                        if checktimes:
-                            times.append(datetime.datetime.now())
-                            print('Before reading from db ',times[-1]-times[-2])
-                                                
-                        all_param_data = run.get_parameter_data()
-                        if checktimes:
-                            times.append(datetime.datetime.now())
-                            print('run.get_parameter_data() ',times[-1]-times[-2])
-                        
-                        #run_matrix2 = []    
-                        meas_params = result_dict[i] # Collect measurement params
-                        set_params = depend_dict[i]  # Collect depend params
-                        setdata = run.get_parameter_data(param_names[meas_params[0]])
-                        
-                        if checktimes:
-                            times.append(datetime.datetime.now())
-                            print('run.get_parameter_data(), only setdata ',times[-1]-times[-2])
-
-                        headernames = ''
-                        headerlabelsandunits = ''
-                        
-                        if checktimes:
-                            times.append(datetime.datetime.now())
-                            print('Db read out ',times[-1]-times[-2])
-
-                        # Pre-allocate data array                       
-                        lset = len(set_params)
-                        lmeas = len(meas_params)
-                        lval = len((setdata[param_names[meas_params[0]]][param_names[0]]).flatten())
-                        run_matrix=np.empty([lval,lset+lmeas])
-                        run_matrix.fill(np.nan)
-                        # Collect depends (set axes) columns
-                        colcounter=0
-                        for j in set_params: 
-                            setdata = (all_param_data[param_names[meas_params[0]]][param_names[j]]).flatten()
-                            run_matrix[0:len(setdata),colcounter]= setdata
-                            headernames += parameters[j].name + "\t"
-                            headerlabelsandunits += parameters[j].label + " (" + parameters[j].unit +")" + "\t"
-                            colcounter=colcounter+1
-                        # Collect measurement (meas axes) columns
-                        if checktimes:
-                            times.append(datetime.datetime.now())
-                            print('Set_params in runmatrix ',times[-1]-times[-2])
-                        
-                        for k in meas_params:
-                            measdata = (all_param_data[param_names[k]][param_names[k]]).flatten()
-                            run_matrix[0:len(measdata),colcounter]=measdata
-                            headernames += parameters[k].name + "\t"
-                            headerlabelsandunits += parameters[k].label + " (" + parameters[k].unit +")" + "\t"
-                            colcounter=colcounter+1
-                        
-                        if checktimes:
-                            times.append(datetime.datetime.now())
-                            print('Meas_params in runmatrix ',times[-1]-times[-2])
-                        
-                        header += headernames + '\n'
-                        header += headerlabelsandunits
-
-                        # Confirming function is a good boy
-                        if not suppress_output:
-                            print("Saving measurement with id " + str(runid) +  " to  "+ fullpath)
-                        
-                        # Actual saving of file
-                        file = fullpath                      
-                        f = open(file, "wb")
-                        np.savetxt(f,np.array([]), header = header)
-
-                        if checktimes:
-                            times.append(datetime.datetime.now())
-                            print('Opening txt file and saving header ',times[-1]-times[-2])
-                        # Routine for properly slicing the slow axes (works for infinite dimensions)
-                        slicearray = np.array([]).astype(int)
-                        if newline_slowaxes == True:
-                            for i in range(0,len(set_params)-1):
-                                slicearray = np.concatenate((slicearray, np.where(run_matrix[:-1,i] != run_matrix[1:,i])[0]+1))
-                                slicearray = np.unique(slicearray)
-                        if checktimes:
-                            times.append(datetime.datetime.now())
-                            print('newline_slowaxes time consumption ',times[-1]-times[-2])
-                        
-                        vsliced=np.split(run_matrix,slicearray, axis=0)
-                        for i in range(0,len(vsliced)): # This is just one write action if newline_slowaxes is turned off (and a bit faster then)
-                            np.savetxt(f,vsliced[i],delimiter='\t')
-                            if i != len(vsliced)-1:
-                                linestr = "\n"
-                                f.write(linestr.encode())
-                        f.close()
-                        if checktimes:
-                            times.append(datetime.datetime.now())
-                            print('Writing of the textfile ',times[-1]-times[-2])
-
-                        # Saving of snapshot + run description to JSON file
-                        with open(fullpathjson, 'w') as f:
-                            if run.snapshot and run.description:
-                                total_json = {**json.loads(sz.to_json_for_storage(run.description)), **run.snapshot}
-                            if not run.snapshot:
-                                if run.description:
-                                    total_json = {**json.loads(sz.to_json_for_storage(run.description))}
-                                    print('Warning: Measurement {ruinid} has no snapshot.')
-                                else:
-                                    print('Warning: Measurement {ruinid} has no snapshot or run description. Axes for plotting cannot be extracted.')
-                            json.dump(total_json, f, indent = 4)
-                    n = n + 1
-                    if checktimes:
-                        times.append(datetime.datetime.now())
-                        print('Total time ',times[-1]-times[0])
-
-    if useopendbconnection == False:
-        configuration['core']['db_location'] = previously_opened_db
-        configuration.save_to_home()
-        initialise_database()
\ No newline at end of file
+                    g.write(_compressed_member(header, self._compression))
+                shutil.copyfileobj(f, g)
+        os.replace(path + '.tmp', path)
+
+    # Closes the *.dat files. When the run is completed, the padding of the "Number of values" in the headers is
+    # removed, so the files are the same as those written by db_extractor. This copies every file once.
+    def close(self):
+        completed = False
+        if self._number_of_values is not None and any([f is not None for f in self._files]):
+            completed = qc.load_by_id(self.runid, conn=self.run.conn).completed
+        for n, f in enumerate(self._files):
+            if f is not None:
+                f.close()
+                self._files[n] = None
+                if completed:
+                    self._trim_header(n)
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
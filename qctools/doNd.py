@@ -6,11 +6,15 @@ import time
 import numpy as np
 import datetime
 from threading import Thread, current_thread
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Process, Event
 import warnings
 import sys
+import json
+import hashlib
 from IPython.display import display, clear_output
 from tabulate import tabulate
+from qctools.setpoint_order import order_setpoints, ramp_rates, ramp_time
 
 # function to get unique values 
 def unique(list1): 
@@ -27,14 +31,18 @@ def unique(list1):
 
 def fill_station(param_set, param_meas):
     station = Station()
-    allinstr=qc.instrument.base.Instrument._all_instruments
+    allinstr=qc.instrument.Instrument._all_instruments
     for key,val in allinstr.items():
-        instr = qc.instrument.base.Instrument.find_instrument(key)
+        instr = qc.instrument.Instrument.find_instrument(key)
         station.add_component(instr)
     measparstring = ""
     for parameter in param_set:
-        station.add_component(parameter)
-        measparstring += parameter.name + ',' 
+        try: # Prevent station crash when component of parameter is not unique, e.g. for the sweeps of doNd_queue
+            station.add_component(parameter)
+            measparstring += parameter.name + ',' 
+        except Exception as e:
+            print('Error ignored when filling station: \n', e)
+            pass
     for parameter in param_meas:
         try: # Prevent station crash when component of parameter is not unique
             station.add_component(parameter)
@@ -46,9 +54,9 @@ def fill_station(param_set, param_meas):
 
 def fill_station_zerodim(param_meas):
     station = Station()
-    allinstr=qc.instrument.base.Instrument._all_instruments
+    allinstr=qc.instrument.Instrument._all_instruments
     for key,val in allinstr.items():
-        instr = qc.instrument.base.Instrument.find_instrument(key)
+        instr = qc.instrument.Instrument.find_instrument(key)
         station.add_component(instr)
     measparstring = ""
     for parameter in param_meas:
@@ -78,14 +86,337 @@ def cartprodmeander(*arrays):
     N = len(arrays)
     fullmesh = np.transpose(np.meshgrid(*arrays, indexing='ij'), 
                      np.roll(np.arange(N + 1), -1)).reshape(-1, N)
-    s = int(len(fullmesh)/len(arrays[-1])/2)
-    for i in range(0,s):
-        # Most unreadable line of code in the world, but it does the meandering of the setpoints somehow...
-        fullmesh[:,-1][(2*i+1)*len(arrays[-1]):(2*i+2)*len(arrays[-1])]=fullmesh[:,-1][(2*i+1)*len(arrays[-1]):(2*i+2)*len(arrays[-1])][::-1]
+    # Reverse the fastest axis on every odd row of the fastest axis
+    rows = fullmesh.reshape(-1, len(arrays[-1]), N)
+    rows[1::2,:,-1] = rows[1::2,::-1,-1]
     return fullmesh
 
-def run_measurement(event, 
-                    param_set, 
+# Number of setpoints of the cartesian product of spaces
+def count_setpoints(spaces):
+    count = 1
+    for space in spaces:
+        count = count*len(space)
+    return count
+
+# Lazy version of cartprod and cartprodmeander: yields the same setpoints one by one, computed from the index of the
+# setpoint, so the memory use does not depend on the number of setpoints. With meander=True the fastest axis is
+# reversed on every odd row, as in cartprodmeander. With meander='full' every axis is reversed on every odd pass of
+# the axis (reflected Gray code order), so every move between two setpoints is a single step on a single axis and no
+# axis ever ramps back to its start value. The setpoints before index start are skipped.
+def iter_cartprod(spaces, meander=False, start=0):
+    dtype = np.result_type(*[np.asarray(space) for space in spaces])
+    spaces = [np.asarray(space, dtype=dtype) for space in spaces]
+    lengths = [len(space) for space in spaces]
+    ndims = len(spaces)
+    # Number of setpoints between two steps of each axis
+    strides = [1]*ndims
+    for j in reversed(range(0,ndims-1)):
+        strides[j] = strides[j+1]*lengths[j+1]
+    for i in range(start,count_setpoints(spaces)):
+        setpoint = [None]*ndims
+        for j in range(0,ndims):
+            index = (i // strides[j]) % lengths[j]
+            # Pass i // (strides[j]*lengths[j]) of axis j is reversed when it is odd
+            if meander == 'full' or (meander == True and j == ndims-1):
+                if (i // (strides[j]*lengths[j])) % 2 == 1:
+                    index = lengths[j]-1-index
+            setpoint[j] = spaces[j][index]
+        yield setpoint
+
+# Yields every setpoint together with a list of the axes whose value changed with respect to the previous setpoint.
+# On the first setpoint all axes count as changed, so they are always set.
+def iter_changes(setpoints):
+    previous = None
+    for setpoint in setpoints:
+        if previous is None:
+            changed = [True]*len(setpoint)
+        else:
+            changed = [value != previousvalue for value, previousvalue in zip(setpoint, previous)]
+        previous = setpoint
+        yield setpoint, changed
+
+# Checkpoints of doNd runs, see the resume argument of doNd. Every run stores the definition of its sweep in the
+# 'doNd_sweep' metadata and the index of its first setpoint in 'doNd_first'. The number of completed setpoints, counted
+# from the start of the sweep and so including the setpoints of the resumed runs, is stored in 'doNd_completed' every
+# _checkpoint_interval seconds, after the data has been flushed to the database, and when the run ends for any reason.
+_checkpoint_interval = 10
+
+# SHA-256 hash of the setpoints in spaces, which stands in for the setpoints in the sweep definition so that the
+# metadata stays small also for large manual setpoint arrays
+def setpoints_hash(spaces, manualsetpoints):
+    if manualsetpoints == True:
+        arrays = [np.asarray(spaces, dtype=float)]
+    else:
+        arrays = [np.asarray(space, dtype=float) for space in spaces]
+    sha = hashlib.sha256()
+    for array in arrays:
+        sha.update(str(array.shape).encode())
+        sha.update(np.ascontiguousarray(array).tobytes())
+    return sha.hexdigest()
+
+# JSON-able definition of the sweep of doNd, used to check that a resumed run continues the same sweep
+def sweep_definition(param_set, param_meas, spaces, meander, manualsetpoints, optimize_order, line_mode):
+    return {'param_set': [parameter.full_name for parameter in param_set],
+            'param_meas': [parameter.full_name for parameter in param_meas],
+            'spaces': setpoints_hash(spaces, manualsetpoints),
+            'meander': meander,
+            'manualsetpoints': manualsetpoints,
+            'optimize_order': optimize_order,
+            'line_acquisition': line_mode}
+
+class _checkpoint:
+    def __init__(self, datasaver, definition, first):
+        self.datasaver = datasaver
+        self.datasaver.dataset.add_metadata('doNd_sweep', json.dumps(definition))
+        self.datasaver.dataset.add_metadata('doNd_first', first)
+        self.completed = first
+        self.lastsave = time.perf_counter()
+
+    # Records that the setpoints before index completed are measured, flush writes pending results of the caller
+    def update(self, completed, flush=None):
+        self.completed = completed
+        if time.perf_counter()-self.lastsave > _checkpoint_interval:
+            self.save(flush)
+
+    def save(self, flush=None):
+        if flush is not None:
+            flush()
+        self.datasaver.flush_data_to_database()
+        self.datasaver.dataset.add_metadata('doNd_completed', self.completed)
+        self.lastsave = time.perf_counter()
+
+# Setpoint order of run runid, which is stored in the run that reordered the setpoints and followed by the runs that
+# resumed it. None when the setpoints were not reordered.
+def stored_setpoint_order(runid):
+    metadata = qc.load_by_id(runid).metadata
+    while 'setpoint_order' not in metadata and 'doNd_resumed_from' in metadata:
+        metadata = qc.load_by_id(int(metadata['doNd_resumed_from'])).metadata
+    if 'setpoint_order' in metadata:
+        return np.array(json.loads(metadata['setpoint_order']))
+    return None
+
+# Index of the first setpoint that was not measured in the interrupted run runid and the setpoint order of that run
+# (None when the setpoints were not reordered). When all param_meas return a single value, the setpoints are also
+# counted from the stored results, so after a crash that came before the next checkpoint (see _checkpoint_interval)
+# only the results that were not yet written to the database are measured again. Otherwise the checkpoint is used,
+# None when the run has none.
+def resume_point(runid, param_meas):
+    dataset = qc.load_by_id(runid)
+    metadata = dataset.metadata
+    order = stored_setpoint_order(runid)
+    completed = None
+    if 'doNd_completed' in metadata:
+        completed = int(metadata['doNd_completed'])
+    for parameter in param_meas:
+        if isinstance(parameter, (qc.instrument.ParameterWithSetpoints, qc.instrument.MultiParameter)):
+            return completed, order
+    name = param_meas[0].full_name
+    stored = int(metadata.get('doNd_first', 0)) + len(dataset.get_parameter_data(name)[name][name])
+    if completed is None:
+        return stored, order
+    return max(completed, stored), order
+
+# Collects the results of run_measurement in preallocated arrays, one per parameter, and adds them to the datasaver
+# in a single add_result call every size points or every interval seconds, whichever comes first. The datasaver stores
+# every element of the arrays as a separate row, so the database holds the same rows as with one add_result per point.
+class _result_buffer:
+    def __init__(self, datasaver, parameters, size, interval):
+        self.datasaver = datasaver
+        self.parameters = parameters
+        self.size = size
+        self.interval = interval
+        self.arrays = None
+        self.n = 0
+        self.lastflush = time.perf_counter()
+
+    def add(self, values):
+        if self.arrays is None: # The dtype of every array follows the first values, ints are stored as floats
+            self.arrays = [np.empty(self.size, dtype=np.result_type(np.asarray(x).dtype, float)) for x in values]
+        for array, x in zip(self.arrays, values):
+            array[self.n] = x
+        self.n += 1
+        if self.n == self.size or time.perf_counter()-self.lastflush > self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.n > 0:
+            self.datasaver.add_result(*[(parameter, array[:self.n].copy()) for parameter, array in zip(self.parameters, self.arrays)])
+            self.n = 0
+        self.lastflush = time.perf_counter()
+
+# Reads out measurement parameter k of param_meas, after running its optional extra command
+def read_parameter(k, parameter, extra_cmd, extra_cmd_val):
+    if extra_cmd is not None: # Optional extra command + value that is run before each measurement paremeter is read out.
+        if extra_cmd[k] is not None:
+            if extra_cmd_val is not None: 
+                if extra_cmd_val[k] is not None:
+                    (extra_cmd[k])(extra_cmd_val[k])
+                else:
+                    (extra_cmd[k])()
+            else:
+                (extra_cmd[k])()
+    return parameter.get()
+
+# Groups the indices of parameters by their instrument, in order of first appearance. Parameters without instrument
+# are a group of their own.
+def instrument_groups(parameters):
+    groups = {}
+    for k, parameter in enumerate(parameters):
+        instrument = getattr(parameter, 'root_instrument', None)
+        if instrument is not None:
+            key = id(instrument)
+        else:
+            key = ('parameter', k)
+        groups.setdefault(key, []).append(k)
+    return list(groups.values())
+
+# Concurrent readout of param_meas for run_measurement. The parameters are grouped by their instrument, the groups are
+# read in parallel and the parameters within a group one after the other in the order of param_meas, each after its
+# extra_cmd. The first group is read on the calling thread, the other groups on a thread pool that lives as long as
+# the measurement. Parameters without instrument are a group of their own.
+class _concurrent_readout:
+    def __init__(self, param_meas, extra_cmd, extra_cmd_val):
+        self.param_meas = param_meas
+        self.extra_cmd = extra_cmd
+        self.extra_cmd_val = extra_cmd_val
+        self.groups = instrument_groups(param_meas)
+        self.executor = None
+        if len(self.groups) > 1:
+            self.executor = ThreadPoolExecutor(max_workers=len(self.groups)-1)
+
+    def _read_group(self, group):
+        return [(k, read_parameter(k, self.param_meas[k], self.extra_cmd, self.extra_cmd_val)) for k in group]
+
+    def read(self, output):
+        futures = []
+        if self.executor is not None:
+            futures = [self.executor.submit(self._read_group, group) for group in self.groups[1:]]
+        results = self._read_group(self.groups[0])
+        for future in futures:
+            results += future.result()
+        for k, value in results:
+            output[k][1] = value
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+# Parallel ramping of param_set for run_measurement. The set parameters that change are grouped by their instrument,
+# the groups are set in parallel and the parameters within a group one after the other in the given order. As for
+# _concurrent_readout, the first group is set on the calling thread and the other groups on a thread pool.
+class _parallel_setter:
+    def __init__(self, param_set):
+        self.param_set = param_set
+        self.group_of = [None]*len(param_set)
+        groups = instrument_groups(param_set)
+        for g, group in enumerate(groups):
+            for j in group:
+                self.group_of[j] = g
+        self.executor = None
+        if len(groups) > 1:
+            self.executor = ThreadPoolExecutor(max_workers=len(groups)-1)
+
+    def _set_group(self, axes, setpoint):
+        for j in axes:
+            self.param_set[j].set(setpoint[j])
+
+    def set(self, axes, setpoint):
+        groups = {}
+        for j in axes:
+            groups.setdefault(self.group_of[j], []).append(j)
+        groups = list(groups.values())
+        futures = []
+        if self.executor is not None:
+            futures = [self.executor.submit(self._set_group, group, setpoint) for group in groups[1:]]
+        self._set_group(groups[0], setpoint)
+        for future in futures:
+            future.result()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+# Latest progress of run_measurement. The measurement thread replaces the whole state at once with publish and the
+# renderer thread reads it with a single attribute access, so neither thread ever waits for the other.
+class _progress_slot:
+    def __init__(self):
+        self.state = None
+        self.done = False
+
+    def publish(self, i, setpoint, values, starttime, now):
+        self.state = (i, setpoint, values, starttime, now)
+
+# Progress table of run_measurement for a state published in _progress_slot
+def _progress_table(state, name, comment, npoints, first, param_setnames, param_setunits, param_measnames, param_measnames_sub, param_measunits, paramtype):
+    i, setpoint, values, starttime, now = state
+    setvals = list(zip(param_setnames,[f"{x:.{6}}" for x in setpoint],param_setunits))
+    outputparsed = [None]*len(param_measnames)
+    for k,x in enumerate(values):
+        if paramtype[k] == 'MultiParameter':
+            valsparsed = [None]*len(x)
+            for l,y in enumerate(x):
+                if isinstance(y, (list,tuple,np.ndarray)):
+                    if len(y) > 5:
+                        vals = ['{:.6f}'.format(x) for x in y[0:5]]
+                        vals.append('.......')
+                    else:
+                        vals = ['{:.6f}'.format(x) for x in y]
+                    newvals = [[vals[i]] for i in range(0,len(vals))]
+                    valsparsed[l] = tabulate(newvals,tablefmt='plain') 
+                else:
+                    valsparsed[l] = f"{y:.{6}}"
+            outputparsed[k] = tabulate(list(zip(param_measnames_sub[k],valsparsed,param_measunits[k])), tablefmt='plain', colalign=('left','left','left'))
+        if paramtype[k] == 'Parameter':
+            outputparsed[k] = tabulate([[f"{float(x):.{6}}",param_measunits[k]]], tablefmt='plain')
+        if paramtype[k] == 'ParameterWithSetpoints':
+            outputparsed[k] = '{Parameter with setpoints, not shown.}'
+    measvals = list(zip(param_measnames,outputparsed))
+
+    #Time estimation
+    finish =['','']
+    frac_complete = (i+1)/npoints
+    elapsed_in_sec = (now-starttime).total_seconds()
+    # Setpoints before first were measured in the run that this run resumes
+    remaining_in_sec = elapsed_in_sec/(i+1-first)*(npoints-i-1)
+    duration_in_sec = elapsed_in_sec+remaining_in_sec
+    perc_complete = np.round(100*frac_complete,2)
+    if i == npoints-1:
+        finish[0] = 'Finished: ' + str((now).strftime('%Y-%m-%d'))
+        finish[1] = str((now).strftime('%H:%M:%S'))
+
+    l1 = tabulate([['----------------------' ,'-------------------------------------------------'],
+                   ['Starting runid:', str(measid)], # Time estimation now in properly aligned table format
+                   ['Name:', name], 
+                   ['Comment:', comment],
+                   ['Set parameter(s):', tabulate(setvals, tablefmt='plain', colalign=('left','left','left'))],
+                   ['Readout parameter(s):', tabulate(measvals, tablefmt='plain', colalign=('left','left'))],
+                   ['______________________' ,'_________________________________________________'],
+                   ['Setpoint: ' + str(i+1) + ' of ' + str(npoints), '%.2f' % perc_complete + ' % complete.'],
+                   ['Started: ' + starttime.strftime('%Y-%m-%d'), starttime.strftime('%H:%M:%S')],
+                   ['ETA: ' + str((datetime.timedelta(seconds=np.round(duration_in_sec))+starttime).strftime('%Y-%m-%d')), str((datetime.timedelta(seconds=np.round(duration_in_sec))+starttime).strftime('%H:%M:%S'))],
+                   [finish[0],finish[1]],
+                   ['Total duration:', str(datetime.timedelta(seconds=np.round(duration_in_sec)))],
+                   ['Elapsed time:', str(datetime.timedelta(seconds=np.round(elapsed_in_sec)))],
+                   ['Remaining time:', str(datetime.timedelta(seconds=np.round(remaining_in_sec)))],
+                   ], colalign=('right','left'), tablefmt='plain')
+    return l1
+
+# Renderer thread of run_measurement: prints the latest published progress every printinterval seconds, and the last
+# state once more after the measurement is done
+def run_progress(progress, printinterval, *tableargs):
+    laststate = None
+    while True:
+        done = progress.done
+        state = progress.state
+        if state is not None and state is not laststate:
+            clear_output(wait=True)
+            print(_progress_table(state, *tableargs))
+            laststate = state
+        if done:
+            break
+        time.sleep(printinterval)
+
+def run_measurement(param_set, 
                     param_meas, 
                     spaces, 
                     settle_times, 
@@ -97,7 +428,14 @@ def run_measurement(event,
                     wait_first_datapoint,
                     checkstepinterdelay,
                     manualsetpoints,
-                    snapshot):
+                    snapshot,
+                    optimize_order=False,
+                    buffer_points=0,
+                    buffer_time=1,
+                    print_interval=0.5,
+                    concurrent_readout=False,
+                    parallel_ramp=False,
+                    resume=None):
     # Local reference of THIS thread object
     t = current_thread()
     # Thread is alive by default
@@ -108,28 +446,39 @@ def run_measurement(event,
     # Apply name
     meas.name = name
 
-    #Generating setpoints
-    if manualsetpoints==False:
-        if meander == True:
-            setpoints = cartprodmeander(*spaces)
-        else:
-            setpoints = cartprod(*spaces)
-    else:
-        setpoints = spaces
     ### Filling station for snapshotting
     if snapshot == True:
         fill_station(param_set,param_meas)
     ### Checking and setting safety rates and delays
     if checkstepinterdelay:
-        safetyratesdelays(param_set,spaces)    
+        if manualsetpoints==False:
+            safetyratesdelays(param_set,spaces)
+        else: # Setpoints of each parameter are in the columns of spaces
+            safetyratesdelays(param_set,np.transpose(spaces))
+
+    #Generating setpoints, one by one while measuring
+    #A resumed run (resume = (runid, first setpoint, setpoint order)) starts at the first setpoint that was not measured
+    first = 0
+    order = None
+    if resume is not None:
+        first = resume[1]
+        order = resume[2]
+    if manualsetpoints==False:
+        setpoints = iter_cartprod(spaces, meander, first)
+        npoints = count_setpoints(spaces)
+    else:
+        setpoints = spaces
+        npoints = len(spaces)
+        if order is not None: # Continue in the order of the resumed run
+            setpoints = spaces[order]
+        elif optimize_order == True: # Visit the setpoints in the order with the shortest ramp time
+            rates = ramp_rates(param_set)
+            order = order_setpoints(spaces, rates)
+            setpoints = spaces[order]
+            print('Setpoints reordered, estimated ramp time {:.3g} s instead of {:.3g} s.'.format(ramp_time(spaces, rates, order), ramp_time(spaces, rates)))
+        setpoints = setpoints[first:]
     
     meas.write_period = 1
-       
-    #Make array showing changes between setpoints on axes
-    changesetpoints = setpoints - np.roll(setpoints, 1, axis=0)
-
-    #Forcing the first setpoint in changesetpoints to 1 to make sure it is always set.
-    changesetpoints[0,:] = 1
    
     # Registering set parameters
     param_setstring = ''
@@ -171,119 +520,263 @@ def run_measurement(event,
         measid = datasaver.run_id
 
         # Getting dimensionality of measurement
-        ndims = setpoints.shape[1]
+        ndims = len(param_set)
         
         # Add comment to metadata in database
         datasaver.dataset.add_metadata('Comment', comment)
+        # Buffered writing is only possible when all readout parameters return a single value
+        buffer = None
+        if buffer_points > 1:
+            if all([x == 'Parameter' for x in paramtype]):
+                buffer = _result_buffer(datasaver, [*param_set, *param_meas], buffer_points, buffer_time)
+            else:
+                print('Warning, buffer_points ignored: buffered writing only supports readout parameters that return a single value.')
+        # Add the index in spaces of every setpoint in visiting order when the setpoints were reordered, a resumed run
+        # continues in the order stored in the run it resumes
+        if order is not None and resume is None:
+            datasaver.dataset.add_metadata('setpoint_order', json.dumps(order.tolist()))
+        # Store the sweep and the progress, to be able to resume the run, and link a resumed run to its predecessor
+        checkpoint = _checkpoint(datasaver, sweep_definition(param_set, param_meas, spaces, meander, manualsetpoints, optimize_order, False), first)
+        if resume is not None:
+            datasaver.dataset.add_metadata('doNd_resumed_from', resume[0])
+            qc.load_by_id(resume[0]).add_metadata('doNd_continued_in', measid)
         
-        # Main loop for setting values
-        for i in range(0,setpoints.shape[0]):
-            #Check for nonzero axis to apply new setpoints by looking in changesetpoints arrays
-            resultlist = [None]*ndims
-            if i==0: #On first datapoint change set_params from slow to fast axis
-                dimlist = range(0,ndims)
-            else: #On all other datapoints change fast axis first
-                dimlist = reversed(range(0,ndims))
-            for j in dimlist:
-                if not np.isclose(changesetpoints[i,j] , 0, atol=0): # Only set set params that need to be changed
-                    if i==0 and not t.alive: # Allows killing of thread in-between initialisiation of set_parameters for first datapoint.
-                        event.set() # Trigger closing of run_dbextractor
+        # Thread pool for reading out the instruments in parallel
+        readout = None
+        if concurrent_readout == True:
+            readout = _concurrent_readout(param_meas, extra_cmd, extra_cmd_val)
+
+        # Thread pool for ramping the set parameters of different instruments in parallel
+        setter = None
+        if parallel_ramp == True:
+            setter = _parallel_setter(param_set)
+
+        # Start the renderer thread for the progress table
+        progress = _progress_slot()
+        renderer = Thread(target = run_progress, args=(progress, print_interval, name, comment, npoints, first,
+                                                       param_setnames, param_setunits, param_measnames,
+                                                       param_measnames_sub, param_measunits, paramtype))
+        renderer.daemon = True
+        renderer.start()
+
+        # Main loop for setting values, buffered results are always added to the datasaver when leaving the loop
+        try:
+            for i, (setpoint, changed) in enumerate(iter_changes(setpoints), first):
+                #Only the axes in changed get a new setpoint
+                resultlist = [None]*ndims
+                if i==first: #On first datapoint change set_params from slow to fast axis
+                    dimlist = range(0,ndims)
+                else: #On all other datapoints change fast axis first
+                    dimlist = reversed(range(0,ndims))
+                if setter is not None: # Ramp the changed set params of different instruments at the same time
+                    axes = [j for j in dimlist if changed[j]]
+                    if i==first and not t.alive:
                         raise KeyboardInterrupt('User interrupted doNd during initialisation of first setpoint.')
-                        # Break out of for loop
-                        break
-                    param_set[j].set(setpoints[i,j])
-                    time.sleep(settle_times[j]) # Apply appropriate settle_time
-                resultlist[j] = (param_set[j],setpoints[i,j]) # Make a list of result
-            if i==0: # Add additional waiting time for first measurement point before readout and start timers
-                time.sleep(wait_first_datapoint)
-                # Start various timers
-                starttime = datetime.datetime.now() + datetime.timedelta(0,-1)
-                lastwrittime = starttime
-                lastprinttime = starttime             
-            for k, parameter in enumerate(param_meas): # Readout all measurement parameters at this setpoint i
-                if extra_cmd is not None: # Optional extra command + value that is run before each measurement paremeter is read out.
-                    if extra_cmd[k] is not None:
-                        if extra_cmd_val is not None: 
-                            if extra_cmd_val[k] is not None:
-                                (extra_cmd[k])(extra_cmd_val[k])
-                            else:
-                                (extra_cmd[k])()
-                        else:
-                            (extra_cmd[k])()
-                output[k][1] = parameter.get()
-            datasaver.add_result(*resultlist, # Add everything to the database
-                                 *output)
-            setvals = list(zip(param_setnames,[f"{x:.{6}}" for x in setpoints[i,:]],param_setunits))
-            outputparsed = [None]*len(param_meas)
-            for k,x in enumerate([row[1] for row in output]):
-                if paramtype[k] == 'MultiParameter':
-                    valsparsed = [None]*len(x)
-                    for l,y in enumerate(x):
-                        if isinstance(y, (list,tuple,np.ndarray)):
-                            if len(y) > 5:
-                                vals = ['{:.6f}'.format(x) for x in y[0:5]]
-                                vals.append('.......')
-                            else:
-                                vals = ['{:.6f}'.format(x) for x in y]
-                            newvals = [[vals[i]] for i in range(0,len(vals))]
-                            valsparsed[l] = tabulate(newvals,tablefmt='plain') 
-                        else:
-                            valsparsed[l] = f"{y:.{6}}"
-                    outputparsed[k] = tabulate(list(zip(param_measnames_sub[k],valsparsed,param_measunits[k])), tablefmt='plain', colalign=('left','left','left'))
-                if paramtype[k] == 'Parameter':
-                    outputparsed[k] = tabulate([[f"{float(x):.{6}}",param_measunits[k]]], tablefmt='plain')
-                if paramtype[k] == 'ParameterWithSetpoints':
-                    outputparsed[k] = '{Parameter with setpoints, not shown.}'
-            measvals = list(zip(param_measnames,outputparsed))
-
-            if not t.alive: # Check if user tried to kill the thread by keyboard interrupt, if so kill it
-                event.set() # Trigger closing of run_dbextractor
-                qctools.db_extraction.db_extractor(dbloc = qc.dataset.sqlite.database.get_DB_location(),  # Run db_extractor once more
-                                   ids=[measid], 
-                                   overwrite=True,
-                                   newline_slowaxes=True,
-                                   no_folders=False,
-                                   suppress_output=True,
-                                   useopendbconnection = True)
-                plot_by_id(measid)
-                raise KeyboardInterrupt('User interrupted doNd. All data flushed to database and extracted to *.dat file.')
-                # Break out of for loop
-                break
-            #Time estimation
-            printinterval = 0.025 # Increase printinterval to save CPU
-            now = datetime.datetime.now()
-            finish =['','']
-            if (now-lastprinttime).total_seconds() > printinterval or i == len(setpoints)-1: # Calculate and print time estimation
-                frac_complete = (i+1)/len(setpoints)
-                duration_in_sec = (now-starttime).total_seconds()/frac_complete
-                elapsed_in_sec = (now-starttime).total_seconds()
-                remaining_in_sec = duration_in_sec-elapsed_in_sec
-                perc_complete = np.round(100*frac_complete,2)
-                clear_output(wait=True)
-                if i == len(setpoints)-1:
-                    finish[0] = 'Finished: ' + str((now).strftime('%Y-%m-%d'))
-                    finish[1] = str((now).strftime('%H:%M:%S'))
-
-                l1 = tabulate([['----------------------' ,'-------------------------------------------------'],
-                               ['Starting runid:', str(measid)], # Time estimation now in properly aligned table format
-                               ['Name:', name], 
-                               ['Comment:', comment],
-                               ['Set parameter(s):', tabulate(setvals, tablefmt='plain', colalign=('left','left','left'))],
-                               ['Readout parameter(s):', tabulate(measvals, tablefmt='plain', colalign=('left','left'))],
-                               ['______________________' ,'_________________________________________________'],
-                               ['Setpoint: ' + str(i+1) + ' of ' + str(len(setpoints)), '%.2f' % perc_complete + ' % complete.'],
-                               ['Started: ' + starttime.strftime('%Y-%m-%d'), starttime.strftime('%H:%M:%S')],
-                               ['ETA: ' + str((datetime.timedelta(seconds=np.round(duration_in_sec))+starttime).strftime('%Y-%m-%d')), str((datetime.timedelta(seconds=np.round(duration_in_sec))+starttime).strftime('%H:%M:%S'))],
-                               [finish[0],finish[1]],
-                               ['Total duration:', str(datetime.timedelta(seconds=np.round(duration_in_sec)))],
-                               ['Elapsed time:', str(datetime.timedelta(seconds=np.round(elapsed_in_sec)))],
-                               ['Remaining time:', str(datetime.timedelta(seconds=np.round(remaining_in_sec)))],
-                               ], colalign=('right','left'), tablefmt='plain')
-                print(l1)
-                lastprinttime = now
-        event.set() # Trigger closing of run_dbextractor
-
-def run_zerodim(event, param_meas, name, comment, wait_first_datapoint,snapshot):
+                    if axes != []:
+                        setter.set(axes, setpoint)
+                        time.sleep(max([settle_times[j] for j in axes])) # Wait once for the longest settle_time
+                    resultlist = [(param_set[j],setpoint[j]) for j in range(0,ndims)]
+                else:
+                    for j in dimlist:
+                        if changed[j]: # Only set set params that need to be changed
+                            if i==first and not t.alive: # Allows killing of thread in-between initialisiation of set_parameters for first datapoint.
+                                raise KeyboardInterrupt('User interrupted doNd during initialisation of first setpoint.')
+                                # Break out of for loop
+                                break
+                            param_set[j].set(setpoint[j])
+                            time.sleep(settle_times[j]) # Apply appropriate settle_time
+                        resultlist[j] = (param_set[j],setpoint[j]) # Make a list of result
+                if i==first: # Add additional waiting time for first measurement point before readout and start timers
+                    time.sleep(wait_first_datapoint)
+                    # Start various timers
+                    starttime = datetime.datetime.now() + datetime.timedelta(0,-1)
+                    lastwrittime = starttime
+                if readout is not None: # Readout the instruments in parallel
+                    readout.read(output)
+                else:
+                    for k, parameter in enumerate(param_meas): # Readout all measurement parameters at this setpoint i
+                        output[k][1] = read_parameter(k, parameter, extra_cmd, extra_cmd_val)
+                if buffer is not None: # Collect the values and add them to the database in bulk
+                    buffer.add([*setpoint, *[row[1] for row in output]])
+                else:
+                    datasaver.add_result(*resultlist, # Add everything to the database
+                                         *output)
+                # Publish the latest values, formatting and printing of the progress happen on the renderer thread
+                progress.publish(i, setpoint, [row[1] for row in output], starttime, datetime.datetime.now())
+                if buffer is not None:
+                    checkpoint.update(i+1, buffer.flush)
+                else:
+                    checkpoint.update(i+1)
+
+                if not t.alive: # Check if user tried to kill the thread by keyboard interrupt, if so kill it
+                    # Leaving the datasaver flushes all data, doNd then closes run_dbextractor which exports the last rows
+                    raise KeyboardInterrupt('User interrupted doNd. All data flushed to database and extracted to *.dat file.')
+                    # Break out of for loop
+                    break
+        finally:
+            if buffer is not None:
+                buffer.flush()
+            checkpoint.save()
+            # The renderer prints the last published state and stops
+            progress.done = True
+            renderer.join()
+            if readout is not None:
+                readout.close()
+            if setter is not None:
+                setter.close()
+
+# Groups the setpoints of iter_cartprod into lines of the fastest axis. Yields the setpoint of the slow axes and the
+# array of fastest axis setpoints of the line, in the order of iter_cartprod, so meandered lines are reversed. The
+# lines before line start are skipped.
+def iter_lines(spaces, meander=False, start=0):
+    nfast = len(spaces[-1])
+    line = []
+    for setpoint in iter_cartprod(spaces, meander, start*nfast):
+        line.append(setpoint[-1])
+        if len(line) == nfast:
+            yield setpoint[:-1], np.array(line)
+            line = []
+
+# Acquires a line of the fastest axis with line_acquisition (see doNd) and returns the values as an array of shape
+# (number of param_meas, number of setpoints on the line). A ParameterWithSetpoints always returns the line in the order
+# of its own setpoints, i.e. of spaces[-1], so its values are reversed for the reversed lines of meander (reverse=True).
+def read_line(line_acquisition, line, nmeas, reverse=False):
+    if isinstance(line_acquisition, qc.instrument.ParameterWithSetpoints):
+        values = line_acquisition.get()
+    else:
+        values = line_acquisition(line)
+    values = np.asarray(values)
+    if values.ndim == 1:
+        values = values.reshape(1, -1)
+    if values.shape != (nmeas, len(line)):
+        raise ValueError('line_acquisition returned values of shape ' + str(values.shape) + ', while ' + str((nmeas, len(line))) + ' was expected.')
+    if reverse and isinstance(line_acquisition, qc.instrument.ParameterWithSetpoints):
+        values = values[:,::-1]
+    return values
+
+# Line mode of run_measurement: the fastest axis is swept by the hardware in line_acquisition, doNd only steps the
+# slow axes and stores every line at once. Every point of the line is stored as a separate row, with the same
+# parameters and setpoints as run_measurement, so the dataset has the same layout as a point by point measurement.
+def run_lines(param_set, 
+              param_meas, 
+              spaces, 
+              settle_times, 
+              name, 
+              comment, 
+              meander, 
+              line_acquisition,
+              wait_first_datapoint,
+              checkstepinterdelay,
+              snapshot,
+              print_interval=0.5,
+              parallel_ramp=False,
+              resume=None):
+    # Local reference of THIS thread object
+    t = current_thread()
+    # Thread is alive by default
+    t.alive = True
+
+    # Create measurement object
+    meas = Measurement() 
+    # Apply name
+    meas.name = name
+
+    ### Filling station for snapshotting
+    if snapshot == True:
+        fill_station(param_set,param_meas)
+    ### Checking and setting safety rates and delays of the slow axes, the fastest axis is swept by the hardware
+    if checkstepinterdelay:
+        safetyratesdelays(param_set[:-1],spaces[:-1])
+
+    meas.write_period = 1
+
+    # Registering set and readout parameters
+    for parameter in param_set:
+        meas.register_parameter(parameter)
+    for parameter in param_meas:
+        meas.register_parameter(parameter, setpoints=(*param_set,))
+    param_setnames = [parameter.name for parameter in param_set]
+    param_setunits = [parameter.unit for parameter in param_set]
+    param_measnames = [parameter.name for parameter in param_meas]
+    param_measunits = [parameter.unit for parameter in param_meas]
+    paramtype = ['Parameter']*len(param_meas)
+
+    nslow = len(param_set)-1
+    nfast = len(spaces[-1])
+    npoints = count_setpoints(spaces)
+    # A resumed run starts at the first line that was not completely measured
+    firstline = 0
+    if resume is not None:
+        firstline = resume[1] // nfast
+    first = firstline*nfast
+
+    # Start measurement routine
+    with meas.run() as datasaver:  
+        global measid
+        measid = datasaver.run_id
+
+        # Add comment to metadata in database
+        datasaver.dataset.add_metadata('Comment', comment)
+        # Store the sweep and the progress, to be able to resume the run, and link a resumed run to its predecessor
+        checkpoint = _checkpoint(datasaver, sweep_definition(param_set, param_meas, spaces, meander, False, False, True), first)
+        if resume is not None:
+            datasaver.dataset.add_metadata('doNd_resumed_from', resume[0])
+            qc.load_by_id(resume[0]).add_metadata('doNd_continued_in', measid)
+
+        # Thread pool for ramping the set parameters of different instruments in parallel
+        setter = None
+        if parallel_ramp == True and nslow > 0:
+            setter = _parallel_setter(param_set[:-1])
+
+        # Start the renderer thread for the progress table
+        progress = _progress_slot()
+        renderer = Thread(target = run_progress, args=(progress, print_interval, name, comment, npoints, first,
+                                                       param_setnames, param_setunits, param_measnames,
+                                                       [None]*len(param_meas), param_measunits, paramtype))
+        renderer.daemon = True
+        renderer.start()
+
+        # Main loop over the lines
+        try:
+            previous = None
+            for i, (slowpoint, line) in enumerate(iter_lines(spaces, meander, firstline), firstline):
+                #Only the slow axes that changed get a new setpoint
+                if i==firstline: #On first line change set_params from slow to fast axis
+                    axes = list(range(0,nslow))
+                else: #On all other lines change fast axis first
+                    axes = [j for j in reversed(range(0,nslow)) if slowpoint[j] != previous[j]]
+                previous = slowpoint
+                if i==firstline and not t.alive:
+                    raise KeyboardInterrupt('User interrupted doNd during initialisation of first setpoint.')
+                if setter is not None and axes != []:
+                    setter.set(axes, slowpoint)
+                    time.sleep(max([settle_times[j] for j in axes])) # Wait once for the longest settle_time
+                else:
+                    for j in axes:
+                        param_set[j].set(slowpoint[j])
+                        time.sleep(settle_times[j]) # Apply appropriate settle_time
+                if i==firstline: # Add additional waiting time for first line before readout and start timers
+                    time.sleep(wait_first_datapoint)
+                    starttime = datetime.datetime.now() + datetime.timedelta(0,-1)
+                values = read_line(line_acquisition, line, len(param_meas), not np.array_equal(line, spaces[-1]))
+                # Add the whole line to the database, one row per point
+                datasaver.add_result(*[(param_set[j], np.full(nfast, slowpoint[j])) for j in range(0,nslow)],
+                                     (param_set[-1], line),
+                                     *[(parameter, values[k]) for k, parameter in enumerate(param_meas)])
+                # Publish the last point of the line for the progress renderer
+                progress.publish((i+1)*nfast-1, [*slowpoint, line[-1]], list(values[:,-1]), starttime, datetime.datetime.now())
+                checkpoint.update((i+1)*nfast)
+
+                if not t.alive: # Check if user tried to kill the thread by keyboard interrupt, if so kill it
+                    raise KeyboardInterrupt('User interrupted doNd. All data flushed to database and extracted to *.dat file.')
+        finally:
+            checkpoint.save()
+            progress.done = True
+            renderer.join()
+            if setter is not None:
+                setter.close()
+
+def run_zerodim(param_meas, name, comment, wait_first_datapoint,snapshot):
     # Local reference of THIS thread object
     t = current_thread()
     # Thread is alive by default
@@ -351,27 +844,164 @@ def run_zerodim(event, param_meas, name, comment, wait_first_datapoint,snapshot)
                        ['Total duration:', str(datetime.timedelta(seconds=np.round(elapsed_in_sec)))],
                        ], colalign=('right','left'), tablefmt='plain')
         print(l1)
-        event.set() # Trigger closing of run_dbextractor
 
 def run_dbextractor(event,dbextractor_write_interval):
     #Controls how often the measurement is written to *.dat file
     lastwrittime = datetime.datetime.now()
+    extractor = None
     while event.is_set()==False:
         timepassedsincelastwrite = (datetime.datetime.now()-lastwrittime).total_seconds()
         if timepassedsincelastwrite > dbextractor_write_interval and measid is not None:
             if timepassedsincelastwrite > 1.5*dbextractor_write_interval:
-                time.sleep(3*timepassedsincelastwrite)
-            qctools.db_extraction.db_extractor(dbloc = qc.dataset.sqlite.database.get_DB_location(), 
-                                               ids=[measid], 
-                                               overwrite=True,
-                                               newline_slowaxes=True,
-                                               no_folders=False,
-                                               suppress_output=True,
-                                               useopendbconnection = True)
+                event.wait(3*timepassedsincelastwrite) # Waits are cut short when the measurement ends
+            if extractor is None: # *.dat files are opened once, afterwards only the new rows are appended
+                extractor = qctools.db_extraction.incremental_extractor(dbloc = qc.dataset.sqlite.database.get_DB_location(), 
+                                                                        runid=measid, 
+                                                                        newline_slowaxes=True,
+                                                                        no_folders=False,
+                                                                        suppress_output=True)
+            extractor.update()
             lastwrittime = datetime.datetime.now()
             #except:
             #    pass
-        time.sleep(dbextractor_write_interval/10)
+        event.wait(dbextractor_write_interval/10)
+    # Event is set after the measurement has been flushed to the database, append the last rows and close the files
+    if measid is not None:
+        if extractor is None:
+            extractor = qctools.db_extraction.incremental_extractor(dbloc = qc.dataset.sqlite.database.get_DB_location(), 
+                                                                    runid=measid, 
+                                                                    newline_slowaxes=True,
+                                                                    no_folders=False,
+                                                                    suppress_output=True)
+        extractor.update()
+        extractor.close()
+
+# Checks the arguments of doNd (see there) and returns the function and the arguments of the measurement thread, or
+# None when there is nothing to measure because the run to resume is already complete. Exits with an error message
+# on invalid arguments. Used by doNd and doNd_queue.
+def prepare_measurement(param_set, 
+                        spaces, 
+                        settle_times, 
+                        param_meas, 
+                        name='', 
+                        comment='', 
+                        meander=False, 
+                        extra_cmd=None, 
+                        extra_cmd_val=None,
+                        wait_first_datapoint=1,
+                        checkstepinterdelay=True,
+                        manualsetpoints=False,
+                        snapshot=True,
+                        optimize_order=False,
+                        buffer_points=0,
+                        buffer_time=1,
+                        print_interval=0.5,
+                        concurrent_readout=False,
+                        parallel_ramp=False,
+                        line_acquisition=None,
+                        resume=None):
+    if manualsetpoints == False:
+        if len(param_set) is not len(spaces):
+            errstr = 'Error: number of param_set is ' + str(len(param_set)) + ', while number of spaces is ' + str(len(spaces)) + '.'
+            sys.exit(errstr)
+    if manualsetpoints == True:
+        if isinstance(spaces,np.ndarray) == False:
+            errstr = 'Error: spaces is of type '+ str(type(spaces)) +' not a numpy error as required when manualsetpoints=True.'    
+            sys.exit(errstr)
+        elif len(param_set) is not spaces.shape[1]:
+            errstr = 'Error: number of param_set is ' + str(len(param_set)) + ', while dimension of spaces array is ' + str(spaces.shape[1]) + '.'
+            sys.exit(errstr)
+    
+    if optimize_order == True and manualsetpoints == False:
+        errstr = 'Error: optimize_order=True requires manualsetpoints=True.'
+        sys.exit(errstr)
+    if line_acquisition is not None:
+        if manualsetpoints == True or extra_cmd is not None or not param_set:
+            errstr = 'Error: line_acquisition requires at least one param_set and is not possible with manualsetpoints or extra_cmd.'
+            sys.exit(errstr)
+        for parameter in param_meas:
+            if isinstance(parameter, (qc.instrument.ParameterWithSetpoints, qc.instrument.MultiParameter)):
+                errstr = 'Error: param_meas ' + parameter.name + ' does not return a single value, as required for line_acquisition.'
+                sys.exit(errstr)
+        if isinstance(line_acquisition, qc.instrument.ParameterWithSetpoints):
+            # The line is stored with the setpoints of spaces[-1], so they have to be those of the instrument
+            linesetpoints = np.asarray(line_acquisition.setpoints[0].get())
+            if linesetpoints.shape != np.shape(spaces[-1]) or not np.allclose(linesetpoints, spaces[-1]):
+                errstr = 'Error: setpoints of line_acquisition ' + line_acquisition.name + ' differ from the fastest axis of spaces.'
+                sys.exit(errstr)
+    if meander not in [False, True, 'full']:
+        errstr = 'Error: meander is ' + str(meander) + ', while it should be False, True or \'full\'.'
+        sys.exit(errstr)
+    if len(param_set) is not len(settle_times):
+        errstr = 'Error: number of param_set is ' + str(len(param_set)) + ', while number of settle_times is ' + str(len(settle_times)) + '.' 
+        sys.exit(errstr)
+    # Find the first setpoint that was not measured in the run to resume
+    if resume is not None:
+        if not param_set:
+            errstr = 'Error: resume is not possible for measurements without param_set.'
+            sys.exit(errstr)
+        dataset = qc.load_by_id(resume)
+        definition = sweep_definition(param_set, param_meas, spaces, meander, manualsetpoints, optimize_order,
+                                      line_acquisition is not None)
+        if dataset.metadata.get('doNd_sweep') != json.dumps(definition):
+            errstr = 'Error: run ' + str(resume) + ' is no doNd run with the same param_set, param_meas, spaces, meander, manualsetpoints, optimize_order and line_acquisition.'
+            sys.exit(errstr)
+        first, order = resume_point(resume, param_meas)
+        if first is None:
+            errstr = 'Error: run ' + str(resume) + ' has no checkpoint to resume from.'
+            sys.exit(errstr)
+        if manualsetpoints == True:
+            npoints = len(spaces)
+        else:
+            npoints = count_setpoints(spaces)
+        if first >= npoints:
+            print('Run ' + str(resume) + ' is already complete, nothing to resume.')
+            return None
+        print('Resuming run ' + str(resume) + ' from setpoint ' + str(first+1) + '.')
+        resume = (resume, first, order)
+
+    if param_set and line_acquisition is not None:
+        return run_lines, (param_set, 
+                           param_meas,
+                           spaces,
+                           settle_times,
+                           name,
+                           comment,
+                           meander,
+                           line_acquisition,
+                           wait_first_datapoint,
+                           checkstepinterdelay,
+                           snapshot,
+                           print_interval,
+                           parallel_ramp,
+                           resume)
+    elif param_set:
+        return run_measurement, (param_set, 
+                                 param_meas,
+                                 spaces,
+                                 settle_times,
+                                 name,
+                                 comment,
+                                 meander,
+                                 extra_cmd,
+                                 extra_cmd_val,
+                                 wait_first_datapoint,
+                                 checkstepinterdelay,
+                                 manualsetpoints,
+                                 snapshot,
+                                 optimize_order,
+                                 buffer_points,
+                                 buffer_time,
+                                 print_interval,
+                                 concurrent_readout,
+                                 parallel_ramp,
+                                 resume)
+    else:
+        return run_zerodim, (param_meas, 
+                             name,
+                             comment,
+                             wait_first_datapoint,
+                             snapshot)
 
 def doNd(param_set, 
          spaces, 
@@ -386,7 +1016,15 @@ def doNd(param_set,
          checkstepinterdelay=True,
          manualsetpoints=False,
          snapshot=True,
-         do_plot=True):
+         do_plot=True,
+         optimize_order=False,
+         buffer_points=0,
+         buffer_time=1,
+         print_interval=0.5,
+         concurrent_readout=False,
+         parallel_ramp=False,
+         line_acquisition=None,
+         resume=None):
     '''
     ----------------------------------------------------------------------------------------------------
     doNd: Generalised measurement function that is able to handle an arbitrary number of set parameters.
@@ -425,7 +1063,10 @@ def doNd(param_set,
         - example:comment = 'More explanation'
     ..............................................................................................................
     meander: Use a meandering pattern for setpoints of the fastest and second to fastest measurement axis.
-        - type: boolean
+             With meander = 'full' all axes meander: every axis reverses direction instead of ramping back to its
+             start value, so each new setpoint is a single step on one axis. The data is stored per setpoint as
+             usual and maps onto the same grid (e.g. with format='grid' in db_extractor).
+        - type: boolean or 'full'
         - example: meander = False (default)
     ..............................................................................................................
     extra_cmd: Optional extra command that is executed before each param_meas is read out
@@ -452,6 +1093,70 @@ def doNd(param_set,
         - type: Boolean
         - example: manualsetpoints = False (default)
     ..............................................................................................................
+    optimize_order: Only with manualsetpoints=True. Visits the setpoints in the order that approximately minimises
+                    the total ramp time, based on 'step' and 'inter_delay' of param_set (see setpoint_order.py).
+                    The data is stored in visiting order, the index in spaces of every setpoint in visiting order is
+                    saved as JSON list in the 'setpoint_order' metadata of the run. A run resumed from it (see
+                    resume) continues in the same order, setpoint_order is then only stored in the first run.
+        - type: Boolean
+        - example: optimize_order = False (default)
+    ..............................................................................................................
+    buffer_points: Collects the results of this many setpoints and adds them to the database at once, which lowers
+                   the overhead per setpoint for fast measurements. The buffer is also written every buffer_time
+                   seconds, when the measurement is interrupted and at the end. Only for readout parameters that
+                   return a single value, 0 adds every setpoint directly.
+        - type: int
+        - example: buffer_points = 0 (default)
+    ..............................................................................................................
+    buffer_time: Maximum number of seconds that results stay in the buffer of buffer_points.
+        - type: float
+        - example: buffer_time = 1 (default)
+    ..............................................................................................................
+    print_interval: Seconds between updates of the progress table. The table is formatted and printed on a
+                    separate thread from the latest values, so it does not slow down the measurement loop.
+        - type: float
+        - example: print_interval = 0.5 (default)
+    ..............................................................................................................
+    concurrent_readout: Reads out the param_meas of different instruments in parallel, so the readout time per
+                        setpoint is that of the slowest instrument instead of the sum of all. Parameters of the same
+                        instrument are still read one after the other, each after its extra_cmd. Only use this when
+                        the extra_cmd of a parameter does not depend on the readout of other instruments.
+        - type: Boolean
+        - example: concurrent_readout = False (default)
+    ..............................................................................................................
+    parallel_ramp: When several param_set change at a setpoint (first setpoint, slow axis steps), the parameters of
+                   different instruments ramp at the same time and doNd waits once for the longest settle_time of
+                   the changed parameters, instead of ramping and settling them one after the other. Parameters of
+                   the same instrument are still set one after the other.
+        - type: Boolean
+        - example: parallel_ramp = False (default)
+    ..............................................................................................................
+    line_acquisition: Line mode for hardware-buffered sweeps of the fastest axis. doNd only steps the slow axes,
+                      the fastest axis of spaces is swept by line_acquisition, which returns the whole line at once:
+                      - a function that is called with the array of fastest axis setpoints of the line (reversed on
+                        meandered lines) and that sweeps param_set[-1] over them, e.g. by programming and triggering
+                        a buffered sweep.
+                      - a ParameterWithSetpoints whose get() returns the line, with its setpoints configured on the
+                        instrument to match spaces[-1]. The instrument sweeps in the order of spaces[-1], on the
+                        reversed lines of meander the values are reversed before they are stored.
+                      It returns an array of shape (len(param_meas), len(spaces[-1])), or of shape
+                      (len(spaces[-1]),) for a single param_meas. param_meas only name the stored values and are
+                      not read out themselves. Every point of the line is stored as a separate row, so the dataset
+                      has the same layout as a point by point measurement. Not possible with manualsetpoints and
+                      extra_cmd.
+        - type: function or ParameterWithSetpoints
+        - example: line_acquisition = None (default)
+    ..............................................................................................................
+    resume: Run id of an interrupted doNd run to continue. doNd is called with the same arguments as that run, it
+            checks that the sweep is the same and measures only the setpoints that were not completed, in a new run
+            that is linked to the interrupted one by the 'doNd_resumed_from' and 'doNd_continued_in' metadata.
+            Every run saves its progress every 10 s and when it ends (also on interrupts and errors) in the
+            'doNd_completed' metadata. When all param_meas return a single value, the stored results are counted
+            as well, so after a crash only the results that were not yet written to the database are measured again.
+            In line mode, resuming starts at the first incomplete line.
+        - type: int
+        - example: resume = None (default)
+    ..............................................................................................................
     snapshot: Controls taking a snapshot of the parameters of all connected instruments
         - type: boolean
         - example: snapshot = True (default) 
@@ -459,21 +1164,13 @@ def doNd(param_set,
     '''
 
 
-    if manualsetpoints == False:
-        if len(param_set) is not len(spaces):
-            errstr = 'Error: number of param_set is ' + str(len(param_set)) + ', while number of spaces is ' + str(len(spaces)) + '.'
-            sys.exit(errstr)
-    if manualsetpoints == True:
-        if isinstance(spaces,np.ndarray) == False:
-            errstr = 'Error: spaces is of type '+ str(type(spaces)) +' not a numpy error as required when manualsetpoints=True.'    
-            sys.exit(errstr)
-        elif len(param_set) is not spaces.shape[1]:
-            errstr = 'Error: number of param_set is ' + str(len(param_set)) + ', while dimension of spaces array is ' + str(spaces.shape[1]) + '.'
-            sys.exit(errstr)
-    
-    if len(param_set) is not len(settle_times):
-        errstr = 'Error: number of param_set is ' + str(len(param_set)) + ', while number of settle_times is ' + str(len(settle_times)) + '.' 
-        sys.exit(errstr)
+    prepared = prepare_measurement(param_set, spaces, settle_times, param_meas, name, comment, meander, extra_cmd,
+                                   extra_cmd_val, wait_first_datapoint, checkstepinterdelay, manualsetpoints, snapshot,
+                                   optimize_order, buffer_points, buffer_time, print_interval, concurrent_readout,
+                                   parallel_ramp, line_acquisition, resume)
+    if prepared is None:
+        return
+
     # Register measid as global parameter
     global measid
     measid = None
@@ -484,28 +1181,7 @@ def doNd(param_set,
         event = Event() # Create event shared by threads
         
         # Define p1 (run_measurement) and p2 (run_dbextractor) as two function to thread
-        if param_set:
-            p1 = Thread(target = run_measurement, args=(event, 
-                                                        param_set, 
-                                                        param_meas, 
-                                                        spaces, 
-                                                        settle_times, 
-                                                        name, 
-                                                        comment, 
-                                                        meander, 
-                                                        extra_cmd, 
-                                                        extra_cmd_val, 
-                                                        wait_first_datapoint,
-                                                        checkstepinterdelay,
-                                                        manualsetpoints,
-                                                        snapshot))
-        else:
-            p1 = Thread(target = run_zerodim, args=(event, 
-                                                    param_meas, 
-                                                    name, 
-                                                    comment,
-                                                    wait_first_datapoint,
-                                                    snapshot))
+        p1 = Thread(target = prepared[0], args=prepared[1])
         # Set writeinterval db_extractor
         dbextractor_write_interval = 15 #sec
         p2 = Thread(target = run_dbextractor, args=(event,dbextractor_write_interval))
@@ -524,6 +1200,9 @@ def doNd(param_set,
                 # Try to join the child thread back to parent for 0.5 seconds
                 p1.join(0.5)
                 p2.join(0.5)
+            # Measurement is finished and flushed to the database, trigger final export and closing of run_dbextractor
+            event.set()
+            p2.join()
         # When kernel interrupt is received (as keyboardinterrupt)
         except KeyboardInterrupt as e:
             # Set the alive attribute to false
@@ -531,19 +1210,151 @@ def doNd(param_set,
             p2.alive = False
             # Block until child thread is joined back to the parent
             p1.join()
-            p2.join(5)
+            event.set()
+            p2.join()
+            if measid is not None and len(param_set) <= 2 and do_plot:
+                plot_by_id(measid)
             # Exit with error code
             sys.exit(e)
-    qctools.db_extraction.db_extractor(dbloc = qc.dataset.sqlite.database.get_DB_location(), 
-                                       ids=[measid], 
-                                       overwrite=True,
-                                       newline_slowaxes=True,
-                                       no_folders=False,
-                                       suppress_output=True,
-                                       useopendbconnection = True)
     if len(param_set) > 2 or not do_plot:
         print('QCoDeS currently does not support plotting of higher dimensional data, plotting skipped.')
     else:
         plot_by_id(measid)
     #sys.exit(0)
-    #return measid
\ No newline at end of file
+    #return measid
+# Extractor thread of doNd_queue. Works as run_dbextractor for the run that is measuring (measid), and exports the
+# last rows and closes the files of every run that doNd_queue appends to finishedruns, while the next run is already
+# measuring. An export error of one run is printed and does not stop the export of the other runs.
+def run_queue_extractor(event,dbextractor_write_interval,finishedruns):
+    lastwrittime = datetime.datetime.now()
+    extractor = None
+    nclosed = 0 # Number of finished runs that are exported completely
+    while True:
+        finished = event.is_set()
+        while nclosed < len(finishedruns):
+            runid = finishedruns[nclosed]
+            try:
+                if extractor is None or extractor.runid != runid:
+                    if extractor is not None:
+                        extractor.close()
+                    extractor = queue_extractor(runid)
+                extractor.update()
+                extractor.close()
+            except Exception as e:
+                print('Error ignored when extracting run ' + str(runid) + ': \n', e)
+            extractor = None
+            nclosed += 1
+        if finished:
+            break
+        runid = measid
+        timepassedsincelastwrite = (datetime.datetime.now()-lastwrittime).total_seconds()
+        if runid is not None and runid not in finishedruns and timepassedsincelastwrite > dbextractor_write_interval:
+            try:
+                if extractor is None or extractor.runid != runid: # *.dat files are opened once, afterwards only the new rows are appended
+                    if extractor is not None:
+                        extractor.close()
+                    extractor = queue_extractor(runid)
+                extractor.update()
+            except Exception as e:
+                print('Error ignored when extracting run ' + str(runid) + ': \n', e)
+            lastwrittime = datetime.datetime.now()
+        time.sleep(0.1)
+    if extractor is not None:
+        extractor.close()
+
+# Live *.dat export of run runid, with the settings of run_dbextractor
+def queue_extractor(runid):
+    return qctools.db_extraction.incremental_extractor(dbloc = qc.dataset.sqlite.database.get_DB_location(), 
+                                                       runid=runid, 
+                                                       newline_slowaxes=True,
+                                                       no_folders=False,
+                                                       suppress_output=True)
+
+def doNd_queue(sweeps, snapshot=True, do_plot=False):
+    '''
+    ----------------------------------------------------------------------------------------------------
+    doNd_queue: Runs a list of doNd measurements back to back, e.g. for an overnight series.
+    ----------------------------------------------------------------------------------------------------
+
+    All measurements are checked and prepared before the first one starts, so an error in the last measurement is
+    found right away and not in the middle of the night. The station is filled once for all measurements and one
+    extractor thread exports all runs to *.dat files: the final export of a run is done while the next run is
+    already measuring. Plotting is done at the end, so the dead time between the runs is almost zero.
+
+    Arguments:
+    ----------
+
+    sweeps: The measurements, each as a dict with the arguments of doNd (do_plot and snapshot are ignored).
+        - type: list of dicts
+        - example: sweeps = [dict(param_set=[gate], spaces=[np.linspace(0,1,101)], settle_times=[0.1],
+                                  param_meas=[current], name='gate sweep'),
+                             dict(param_set=[bias, gate], ... etc)]
+    ..............................................................................................................
+    snapshot: Fills the station once with all instruments and parameters of all sweeps, so every run stores a
+              snapshot of them
+        - type: boolean
+        - example: snapshot = True (default)
+    ..............................................................................................................
+    do_plot: Plots all runs with at most 2 set parameters after the last run has finished
+        - type: boolean
+        - example: do_plot = False (default)
+    ..............................................................................................................
+
+    Returns the run ids of the measurements, None for a resumed run that was already complete.
+    '''
+    # Check and prepare all measurements, the station is filled below for all of them at once
+    prepared = []
+    for sweep in sweeps:
+        kwargs = dict(sweep)
+        kwargs.pop('do_plot', None)
+        kwargs['snapshot'] = False
+        prepared.append(prepare_measurement(**kwargs))
+    if snapshot == True:
+        param_set = unique([parameter for sweep in sweeps for parameter in sweep.get('param_set', [])])
+        param_meas = unique([parameter for sweep in sweeps for parameter in sweep['param_meas'] if parameter not in param_set])
+        fill_station(param_set, param_meas)
+
+    # Register measid as global parameter
+    global measid
+    measid = None
+
+    # One extractor thread for all runs
+    event = Event()
+    dbextractor_write_interval = 15 #sec
+    finishedruns = []
+    p2 = Thread(target = run_queue_extractor, args=(event,dbextractor_write_interval,finishedruns))
+    p2.start()
+    runids = []
+    p1 = None
+    try:
+        for k, measurement in enumerate(prepared):
+            if measurement is None:
+                runids.append(None)
+                continue
+            measid = None
+            p1 = Thread(target = measurement[0], args=measurement[1])
+            p1.start()
+            # join returns as soon as the measurement is done, the timeout only allows catching kernel interrupts
+            while p1.is_alive():
+                p1.join(0.5)
+            runids.append(measid)
+            if measid is not None: # Hand the run over to the extractor thread for its final export
+                finishedruns.append(measid)
+        # The last run is finished and flushed to the database, trigger its final export and closing of the extractor
+        event.set()
+        p2.join()
+    # When kernel interrupt is received (as keyboardinterrupt), stop the current run and skip the rest of the queue
+    except KeyboardInterrupt as e:
+        if p1 is not None:
+            p1.alive = False
+            p1.join()
+            if measid is not None and measid not in finishedruns:
+                finishedruns.append(measid)
+        event.set()
+        p2.join()
+        sys.exit(e)
+    if do_plot:
+        for k, runid in enumerate(runids):
+            if runid is not None and len(sweeps[k].get('param_set', [])) <= 2:
+                plot_by_id(runid)
+    return runids
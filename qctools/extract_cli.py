@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import argparse
+from qctools.db_extraction import db_extractor, incremental_extractor, extraction_profile, _readonly_connection, \
+    _export_formats
+
+# Command line wrapper around db_extractor, installed as the qct-extract console script.
+#
+#   qct-extract experiments.db                      extracts all runs once
+#   qct-extract experiments.db --watch              keeps extracting new and growing runs until Ctrl+C
+#   qct-extract experiments.db --ids 12 13 -o D:/data --format dat npz
+#
+# The database is only read through a read-only connection (see readonly in db_extractor) and the extraction keeps a
+# manifest (see manifest in db_extractor), so runs that did not change since the previous extraction are skipped.
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog='qct-extract', description='Extract runs from a qcodes database to files.')
+    parser.add_argument('dbloc', help='path of the .db file')
+    parser.add_argument('-o', '--extractpath', default=None,
+                        help='extraction location, defaults to a folder next to the database')
+    parser.add_argument('--ids', nargs='+', type=int, default=[], help='run ids to extract, default: all runs')
+    parser.add_argument('--format', nargs='+', default=['dat'],
+                        help='export formats: dat, dat.gz, dat.zst, npz, npy, hdf5, grid')
+    parser.add_argument('--chunksize', type=int, default=None, help='rows read and written per chunk')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--overwrite', action='store_true', help='extract all requested runs again')
+    parser.add_argument('--no-timestamp', dest='timestamp', action='store_false',
+                        help='leave the timestamp out of the folder names')
+    parser.add_argument('--paramtofilename', action='store_true', help='add the parameter names to the filenames')
+    parser.add_argument('--no-newline', dest='newline_slowaxes', action='store_false',
+                        help='no blank lines when a slow axis changes')
+    parser.add_argument('--no-folders', dest='no_folders', action='store_true', help='no folder per run')
+    parser.add_argument('--watch', action='store_true', help='keep polling the database for new and growing runs')
+    parser.add_argument('--interval', type=float, default=5, help='polling interval in seconds for --watch')
+    parser.add_argument('--profile', default=None, help='write the timing profile of the extraction to this .json file')
+    parser.add_argument('-q', '--quiet', dest='suppress_output', action='store_true', help='suppress output')
+    return parser.parse_args(argv)
+
+# Cheap check whether the database changed. The modification times of the .db file and its write-ahead log change with
+# every commit, PRAGMA data_version changes when another connection committed. None of these take a lock.
+def _db_signature(dbloc, conn):
+    mtimes = []
+    for path in [dbloc, dbloc + '-wal']:
+        if os.path.exists(path):
+            mtimes.append(os.stat(path).st_mtime_ns)
+    data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+    return (tuple(mtimes), data_version)
+
+# Live export of a run that is measuring: one incremental_extractor per text format in format, the other formats are
+# only written when the run is completed.
+def _incremental_extractors(dbloc, runid, extractpath=None, timestamp=True, paramtofilename=False,
+                            newline_slowaxes=True, no_folders=False, suppress_output=False, format='dat', **kwargs):
+    return [incremental_extractor(dbloc, runid, extractpath=extractpath, timestamp=timestamp,
+                                  paramtofilename=paramtofilename, newline_slowaxes=newline_slowaxes,
+                                  no_folders=no_folders, suppress_output=suppress_output, format=fmt)
+            for fmt in _export_formats(format) if fmt in ['dat', 'dat.gz', 'dat.zst']]
+
+# Polls the database every interval seconds. A run that is measuring is exported with incremental_extractor, so every
+# poll only reads and appends the rows that were added since the previous one. New runs that are already completed,
+# and runs that completed since the previous poll, are extracted once with db_extractor. Completed runs that were
+# extracted are not looked at again.
+def watch(dbloc, interval=5, ids=[], **kwargs):
+    dbloc = os.path.abspath(dbloc)
+    conn = _readonly_connection(dbloc)
+    done = set()
+    growing = {} # incremental_extractors of the runs that are measuring, per run id
+    signature = None
+    try:
+        while True:
+            newsignature = _db_signature(dbloc, conn)
+            if newsignature != signature:
+                signature = newsignature
+                runs = conn.execute('SELECT run_id, is_completed FROM runs').fetchall()
+                runs = [run for run in runs if run[0] not in done and (ids == [] or run[0] in ids)]
+                completed = [run[0] for run in runs if run[1]]
+                if completed != []:
+                    # The live files are closed before db_extractor writes the final files over them
+                    for runid in completed:
+                        for extractor in growing.pop(runid, []):
+                            extractor.close()
+                    db_extractor(dbloc=dbloc, ids=completed, readonly=True, manifest=True, **kwargs)
+                    done.update(completed)
+                for runid in [run[0] for run in runs if not run[1]]:
+                    if runid not in growing:
+                        growing[runid] = _incremental_extractors(dbloc, runid, **kwargs)
+                    for extractor in growing[runid]:
+                        extractor.update()
+            time.sleep(interval)
+    finally:
+        for extractors in growing.values():
+            for extractor in extractors:
+                extractor.close()
+        conn.close()
+
+def main(argv=None):
+    args = _parse_args(argv)
+    if not os.path.isfile(args.dbloc):
+        print(f'Database {args.dbloc} does not exist')
+        return 1
+    kwargs = dict(extractpath=args.extractpath, overwrite=args.overwrite, timestamp=args.timestamp,
+                  paramtofilename=args.paramtofilename, newline_slowaxes=args.newline_slowaxes,
+                  no_folders=args.no_folders, suppress_output=args.suppress_output, workers=args.workers,
+                  format=args.format, chunksize=args.chunksize)
+    if args.watch:
+        try:
+            watch(args.dbloc, interval=args.interval, ids=args.ids, **kwargs)
+        except KeyboardInterrupt:
+            pass
+    else:
+        profile = extraction_profile()
+        db_extractor(dbloc=os.path.abspath(args.dbloc), ids=args.ids, readonly=True, manifest=True, profile=profile,
+                     **kwargs)
+        if args.profile is not None:
+            profile.dump(args.profile)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import numpy as np
+
+# Helpers to turn the flat table of a run (one row per point, the set columns first with the slowest axis in the first
+# column) into dense N-d arrays with one dimension per set axis. Used by the 'grid' export format of db_extractor.
+#
+# The axis values are taken in the order in which they first appear, so an axis swept from high to low stays in that
+# order. Every row is placed by its set values and not by its position in the table, so the reversed rows of a
+# meandered sweep (see cartprodmeander in doNd) come out un-reversed. Set values are compared exactly, which holds for
+# the setpoints that are stored by doNd.
+
+# Unique values of column in order of first appearance, together with the index of every row into these values
+def _axis_values(column):
+    values, first, inverse = np.unique(column, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.intp)
+    rank[order] = np.arange(len(order))
+    return values[order], rank[inverse.ravel()]
+
+# Detects whether the set columns (nrows x nset) form a rectangular grid. Returns the axis coordinate vectors and the
+# flat index of every row in the grid, or None when the points are no grid: when a set column holds NaN, when a point
+# occurs twice, or when more is missing than the last (interrupted) slice of the slowest axis.
+def grid_axes(set_columns):
+    set_columns = np.asarray(set_columns, dtype=float)
+    nrows, nset = set_columns.shape
+    if nrows == 0 or nset == 0 or np.isnan(set_columns).any():
+        return None
+    axes = []
+    indices = []
+    for j in range(nset):
+        values, index = _axis_values(set_columns[:,j])
+        axes.append(values)
+        indices.append(index)
+    shape = tuple([len(values) for values in axes])
+    size = 1
+    for n in shape:
+        size = size*n
+    missing = size - nrows
+    if missing < 0 or missing >= size // shape[0]:
+        return None
+    flat = np.ravel_multi_index(indices, shape)
+    if np.count_nonzero(np.bincount(flat, minlength=size)) != nrows:
+        return None
+    return axes, flat
+
+# Dense N-d arrays of the meas columns of run_matrix, the first nset columns are the set columns. Returns the axis
+# coordinate vectors and a list with an array per meas column, points that were not measured are NaN. Returns None when
+# the set columns are no grid, see grid_axes.
+def to_grid(run_matrix, nset):
+    grid = grid_axes(run_matrix[:,:nset])
+    if grid is None:
+        return None
+    axes, flat = grid
+    shape = tuple([len(values) for values in axes])
+    arrays = []
+    for k in range(nset, run_matrix.shape[1]):
+        array = np.full(int(np.prod(shape)), np.nan)
+        array[flat] = run_matrix[:,k]
+        arrays.append(array.reshape(shape))
+    return axes, arrays
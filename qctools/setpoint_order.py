@@ -0,0 +1,158 @@
+import time
+import numpy as np
+
+# Ordering of the (n, m) setpoint array of doNd with manualsetpoints=True, to shorten the total ramp time for
+# scattered or irregular point sets.
+#
+# A set parameter ramps in steps of 'step' with 'inter_delay' seconds per step, so ramping it over a distance x takes
+# x*inter_delay/step seconds. doNd sets the parameters one after the other, so the ramp time between two setpoints is
+# the L1 distance between them after scaling every axis with its ramp rate inter_delay/step. The order is built with
+# the nearest neighbour heuristic and then improved with 2-opt moves between each point and its nearest neighbours.
+# The nearest neighbours are found with scipy.spatial.cKDTree when scipy is installed, otherwise with numpy.
+
+# Seconds per unit of every set parameter when ramping, inter_delay/step. A parameter without step or inter_delay
+# jumps to its setpoint and gets 0.
+def ramp_rates(param_set):
+    rates = np.zeros(len(param_set))
+    for j, parameter in enumerate(param_set):
+        if parameter.step and parameter.inter_delay:
+            rates[j] = parameter.inter_delay/parameter.step
+    return rates
+
+# Total ramp time in seconds when visiting the setpoints in the given order
+def ramp_time(setpoints, rates, order=None):
+    setpoints = np.asarray(setpoints, dtype=float)
+    if order is not None:
+        setpoints = setpoints[order]
+    return float(np.abs(np.diff(setpoints*rates, axis=0)).sum())
+
+def _kdtree():
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        return None
+    return cKDTree
+
+# Indices of the k nearest neighbours of every point (excluding the point itself) in L1 distance
+def _neighbours(scaled, k):
+    n = len(scaled)
+    k = min(k, n-1)
+    cKDTree = _kdtree()
+    if cKDTree is not None:
+        neighbours = cKDTree(scaled).query(scaled, k=k+1, p=1)[1]
+        return neighbours[:,1:]
+    neighbours = np.empty((n, k), dtype=np.intp)
+    block = max(1, 2**22 // n)
+    for start in range(0, n, block):
+        stop = min(n, start+block)
+        distances = np.abs(scaled[start:stop,None,:] - scaled[None,:,:]).sum(axis=2)
+        distances[np.arange(stop-start), np.arange(start, stop)] = np.inf
+        nearest = np.argpartition(distances, k-1, axis=1)[:,:k]
+        rank = np.argsort(np.take_along_axis(distances, nearest, axis=1), axis=1)
+        neighbours[start:stop] = np.take_along_axis(nearest, rank, axis=1)
+    return neighbours
+
+# Nearest neighbour path through all points, starting at point start
+def _nearest_neighbour_path(scaled, start):
+    n = len(scaled)
+    path = np.empty(n, dtype=np.intp)
+    path[0] = start
+    cKDTree = _kdtree()
+    if cKDTree is None:
+        # Remaining points are kept at the front of remaining, a visited point is swapped with the last remaining one
+        remaining = np.arange(n)
+        points = scaled.copy()
+        remaining[start], remaining[n-1] = n-1, start
+        points[[start, n-1]] = points[[n-1, start]]
+        for i in range(1, n):
+            last = n-i
+            k = int(np.argmin(np.abs(points[:last] - scaled[path[i-1]]).sum(axis=1)))
+            path[i] = remaining[k]
+            remaining[k] = remaining[last-1]
+            points[k] = points[last-1]
+        return path
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    index = np.arange(n)
+    tree = cKDTree(scaled)
+    for i in range(1, n):
+        current = scaled[path[i-1]]
+        found = np.atleast_1d(tree.query(current, k=min(16, len(index)), p=1)[1])
+        unvisited = [index[f] for f in found if f < len(index) and not visited[index[f]]]
+        if unvisited == []:
+            # All near points are visited, rebuild the tree from the remaining points
+            index = np.flatnonzero(~visited)
+            tree = cKDTree(scaled[index])
+            unvisited = [index[int(tree.query(current, k=1, p=1)[1])]]
+        path[i] = unvisited[0]
+        visited[path[i]] = True
+    return path
+
+# 2-opt on an open path: reverses a section of the path when that shortens it. Only moves that connect a point to one
+# of its nearest neighbours are tried, and points whose surroundings did not change are not looked at again.
+def _two_opt(scaled, path, neighbours, timeout):
+    n = len(path)
+    points = [tuple(row) for row in scaled.tolist()]
+    def dist(a, b):
+        return sum([abs(x-y) for x, y in zip(points[a], points[b])])
+    position = np.empty(n, dtype=np.intp)
+    position[path] = np.arange(n)
+    eps = 1e-12*max(1.0, float(np.abs(scaled).max()))
+    queue = list(path)
+    queued = np.ones(n, dtype=bool)
+    deadline = time.perf_counter() + timeout
+    while queue != [] and time.perf_counter() < deadline:
+        a = queue.pop()
+        queued[a] = False
+        i = position[a]
+        for c in neighbours[a]:
+            j = position[c]
+            if j > i+1:
+                # a -> b ... c -> d becomes a -> c ... b -> d
+                b = path[i+1]
+                d = path[j+1] if j+1 < n else None
+                gain = dist(a, b) - dist(a, c)
+                if d is not None:
+                    gain += dist(c, d) - dist(b, d)
+                start, stop = i+1, j
+            elif 0 < j < i-1:
+                # e -> c ... p -> a becomes e -> p ... c -> a, the first point of the path stays in place
+                p = path[i-1]
+                e = path[j-1]
+                gain = dist(p, a) + dist(e, c) - dist(c, a) - dist(e, p)
+                start, stop = j, i-1
+            else:
+                continue
+            if gain > eps:
+                path[start:stop+1] = path[start:stop+1][::-1]
+                position[path[start:stop+1]] = np.arange(start, stop+1)
+                # Look at the four points of the two new connections again
+                ends = [path[start-1], path[start], path[stop]]
+                if stop+1 < n:
+                    ends.append(path[stop+1])
+                for point in ends:
+                    if not queued[point]:
+                        queue.append(point)
+                        queued[point] = True
+                break
+    return path
+
+def order_setpoints(setpoints, rates, start=0, neighbours=8, timeout=60):
+    '''
+    Order of the rows of the (n, m) setpoint array that approximately minimises the total ramp time, see ramp_rates
+    and ramp_time. Returns the indices of the rows in visiting order, setpoints[order] are the reordered setpoints.
+
+    setpoints: (n, m) array with all setpoints n of m set parameters, as for doNd with manualsetpoints=True
+    rates: ramp rate in seconds per unit of every set parameter, see ramp_rates
+    start: index of the first setpoint of the path. Default: 0
+    neighbours: number of nearest neighbours of every point that are tried in the 2-opt moves. Default: 8
+    timeout: maximum number of seconds spent on 2-opt improvements. Default: 60
+    '''
+    setpoints = np.asarray(setpoints, dtype=float)
+    n = len(setpoints)
+    if n < 3 or not np.any(rates):
+        return np.arange(n)
+    scaled = setpoints*np.asarray(rates, dtype=float)
+    path = _nearest_neighbour_path(scaled, start)
+    path = _two_opt(scaled, path, _neighbours(scaled, neighbours), timeout)
+    return path
@@ -13,4 +13,12 @@ setup(name='qctools',
           'jupyter',
 	  'lab'
       ],
+      extras_require={
+          'hdf5': ['h5py'],
+          'zstd': ['zstandard'],
+          'pyarrow': ['pyarrow']
+      },
+      entry_points={
+          'console_scripts': ['qct-extract=qctools.extract_cli:main']
+      },
       zip_safe=False)
\ No newline at end of file
@@ -0,0 +1,52 @@
+# Helpers of the doNd checks: a temporary database, doNd without plots and snapshots, and the stored data of runs.
+import os
+import tempfile
+import numpy as np
+import qcodes as qc
+from qcodes.dataset import initialise_or_create_database_at, load_or_create_experiment, load_last_experiment
+import qctools.db_extraction
+from qctools.doNd import doNd
+
+# Creates and opens a new database in a temporary folder, the *.dat files of doNd are written next to it
+def new_database():
+    dbloc = os.path.join(tempfile.mkdtemp(), 'checks.db')
+    initialise_or_create_database_at(dbloc)
+    load_or_create_experiment('checks', sample_name='checks')
+    return dbloc
+
+def last_runid():
+    return load_last_experiment().last_data_set().run_id
+
+# Runs doNd without waiting, snapshot and plot, and returns the run id. An interruption of the measurement (SystemExit
+# or an exception raised in the measurement) is caught, the run id of the interrupted run is returned.
+def measure(param_set, spaces, param_meas, **kwargs):
+    kwargs.setdefault('wait_first_datapoint', 0)
+    try:
+        doNd(param_set, spaces, [0]*len(param_set), param_meas, snapshot=False, do_plot=False, **kwargs)
+    except (SystemExit, Exception) as e:
+        print('Measurement interrupted:', e)
+    return last_runid()
+
+# Stored setpoints and values of the run as a matrix with the columns of param_set and then param_meas
+def run_matrix(runid, param_set, param_meas):
+    data = qc.load_by_id(runid).get_parameter_data()
+    first = data[param_meas[0].full_name]
+    columns = [first[parameter.full_name] for parameter in param_set]
+    columns += [data[parameter.full_name][parameter.full_name] for parameter in param_meas]
+    return np.column_stack(columns)
+
+def same_data(runid1, runid2):
+    data1 = qc.load_by_id(runid1).get_parameter_data()
+    data2 = qc.load_by_id(runid2).get_parameter_data()
+    return data1.keys() == data2.keys() and all([data1[p].keys() == data2[p].keys() for p in data1]) and \
+        all([np.array_equal(data1[p][q], data2[p][q]) for p in data1 for q in data1[p]])
+
+# Total time covered by the (start, stop) intervals, overlapping intervals count once
+def busy_time(intervals):
+    total = 0
+    end = -np.inf
+    for start, stop in sorted(intervals):
+        if stop > end:
+            total += stop - max(start, end)
+            end = stop
+    return total
@@ -0,0 +1,47 @@
+# Check of concurrent_readout in doNd with mock instruments that take 20 ms per readout: the readouts of different
+# instruments run at the same time, the stored data is the same as with sequential readout and the extra_cmd of a
+# parameter still runs right before its readout.
+#
+# Usage: python tests/test_concurrent_readout.py (the functions test_* also run under pytest)
+import time
+import numpy as np
+from qcodes.parameters import Parameter
+from qcodes.instrument import Instrument
+from measurement_setup import new_database, measure, same_data, busy_time
+
+def test_concurrent_readout():
+    new_database()
+    x = Parameter('x', unit='V', set_cmd=None, get_cmd=None, step=0.1, inter_delay=1e-4)
+    reads = []
+    log = []
+    def slow_get(offset):
+        start = time.perf_counter()
+        time.sleep(0.02)
+        reads.append((start, time.perf_counter()))
+        return x() + offset
+    instruments = [Instrument(name) for name in ['readout_li1', 'readout_li2', 'readout_dmm']]
+    try:
+        for k, instrument in enumerate(instruments):
+            instrument.add_parameter('v', get_cmd=lambda k=k: slow_get(k))
+        instruments[2].add_parameter('w', get_cmd=lambda: (log.append('get'), 5.0)[1])
+        param_meas = [instruments[0].v, instruments[1].v, instruments[2].v, instruments[2].w]
+        extra = dict(extra_cmd=[None, None, None, log.append], extra_cmd_val=[None, None, None, 'cmd'])
+        durations = []
+        runids = []
+        for concurrent in [False, True]:
+            reads.clear()
+            runids.append(measure([x], [np.linspace(0,1,20)], param_meas, concurrent_readout=concurrent, **extra))
+            durations.append(busy_time(reads))
+        print('Time spent reading, sequential: {:.2f} s, concurrent: {:.2f} s'.format(*durations))
+        assert same_data(runids[0], runids[1])
+        assert log == ['cmd', 'get']*40
+        # 60 readouts of 20 ms, three at a time when concurrent
+        assert durations[0] > 60*0.02 - 0.01
+        assert durations[1] < 20*0.02*1.5
+    finally:
+        for instrument in instruments:
+            instrument.close()
+
+if __name__ == '__main__':
+    test_concurrent_readout()
+    print('test_concurrent_readout: OK')
@@ -0,0 +1,195 @@
+# Checks of the extraction to files: the live export of incremental_extractor, which doNd writes while measuring, ends
+# up with the same files as db_extractor once the run is completed, also when it is updated in between rows. The
+# other ways of extracting (read-only connection, worker processes, chunks, compressed files) give the same files as
+# well.
+#
+# Usage: python tests/test_extraction.py (the functions test_* also run under pytest)
+import os
+import glob
+import gzip
+import sqlite3
+import tempfile
+import numpy as np
+import pytest
+from qcodes.dataset import initialise_or_create_database_at, load_or_create_experiment, Measurement
+from qcodes.parameters import Parameter
+from qctools import db_extraction
+from qctools.db_extraction import db_extractor, db_extractor_batch, incremental_extractor
+
+# Creates and opens a new database in a temporary folder, returns the folder and the location of the database
+def new_database():
+    folder = tempfile.mkdtemp()
+    dbloc = os.path.join(folder, 'extraction.db')
+    initialise_or_create_database_at(dbloc)
+    load_or_create_experiment('extraction', sample_name='checks')
+    return folder, dbloc
+
+# Measures a map of a on (x, y) and a line of b on x, with a nan in a. Every few rows the results are written to the
+# database and update() of the extractors made by extractors(runid) is called. The parameters get the names in
+# names. Returns the run id.
+def measure_run(name='map', extractors=lambda runid: [], rows_per_update=4, names=('x', 'y', 'a', 'b')):
+    x = Parameter(names[0], unit='V', set_cmd=None, get_cmd=None)
+    y = Parameter(names[1], unit='V', set_cmd=None, get_cmd=None)
+    a = Parameter(names[2], unit='A', get_cmd=None)
+    b = Parameter(names[3], unit='A', get_cmd=None)
+    measurement = Measurement()
+    measurement.name = name
+    measurement.register_parameter(x)
+    measurement.register_parameter(y)
+    measurement.register_parameter(a, setpoints=(x, y))
+    measurement.register_parameter(b, setpoints=(x,))
+    rng = np.random.default_rng(0)
+    with measurement.run() as datasaver:
+        live = extractors(datasaver.run_id)
+        n = 0
+        for xvalue in np.linspace(0, 1, 6):
+            for yvalue in np.linspace(-1, 1, 7):
+                avalue = np.nan if n == 10 else rng.standard_normal()
+                datasaver.add_result((x, xvalue), (y, yvalue), (a, avalue))
+                if yvalue == -1:
+                    datasaver.add_result((x, xvalue), (b, rng.standard_normal()))
+                n = n + 1
+                if n % rows_per_update == 0:
+                    datasaver.flush_data_to_database()
+                    for extractor in live:
+                        extractor.update()
+        runid = datasaver.run_id
+    for extractor in live:
+        extractor.update()
+        extractor.close()
+    return runid
+
+# Text of a *.dat, *.dat.gz or *.dat.zst file, read across all compressed members
+def dat_text(path):
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            return f.read()
+    if path.endswith('.zst'):
+        import zstandard
+        with zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True) as f:
+            return f.read()
+    with open(path, 'rb') as f:
+        return f.read()
+
+# Contents of all files below folder by their path relative to folder, the manifest of db_extractor left out
+def folder_files(folder):
+    files = {}
+    for path in glob.glob(os.path.join(folder, '**', '*'), recursive=True):
+        if os.path.isfile(path) and os.path.basename(path) != 'extraction_manifest.json':
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, folder)] = f.read()
+    return files
+
+def test_incremental():
+    folder, dbloc = new_database()
+    live = os.path.join(folder, 'live')
+    for rows_per_update in [1, 4, 9]:
+        measure_run(extractors=lambda runid: [incremental_extractor(dbloc, runid, extractpath=live)],
+                    rows_per_update=rows_per_update)
+    db_extractor(dbloc, extractpath=os.path.join(folder, 'full'), useopendbconnection=True, suppress_output=True)
+    full = folder_files(os.path.join(folder, 'full'))
+    assert len([path for path in full if path.endswith('.dat')]) == 6
+    assert folder_files(live) == full
+
+# The read-only connections give the same files and are closed afterwards
+def test_readonly():
+    folder, dbloc = new_database()
+    connections = []
+    def readonly_connection(dbloc):
+        connections.append(open_connection(dbloc))
+        return connections[-1]
+    open_connection = db_extraction._readonly_connection
+    db_extraction._readonly_connection = readonly_connection
+    try:
+        live = os.path.join(folder, 'live')
+        measure_run(extractors=lambda runid: [incremental_extractor(dbloc, runid, extractpath=live)])
+        measure_run(name='second')
+        db_extractor(dbloc, extractpath=os.path.join(folder, 'full'), useopendbconnection=True, suppress_output=True)
+        db_extractor(dbloc, extractpath=os.path.join(folder, 'readonly'), readonly=True, suppress_output=True)
+    finally:
+        db_extraction._readonly_connection = open_connection
+    assert len(connections) == 2
+    for conn in connections:
+        with pytest.raises(sqlite3.ProgrammingError): # Closed
+            conn.execute('SELECT 1')
+    full = folder_files(os.path.join(folder, 'full'))
+    assert folder_files(os.path.join(folder, 'readonly')) == full
+    assert folder_files(live) == {path: data for path, data in full.items() if 'map' in path}
+
+# Spreading the runs over worker processes gives the same files
+def test_workers():
+    folder, dbloc = new_database()
+    measure_run()
+    measure_run(name='second')
+    db_extractor(dbloc, extractpath=os.path.join(folder, 'full'), useopendbconnection=True, suppress_output=True)
+    db_extractor(dbloc, extractpath=os.path.join(folder, 'workers'), workers=2, suppress_output=True)
+    assert folder_files(os.path.join(folder, 'workers')) == folder_files(os.path.join(folder, 'full'))
+
+# Reading the runs in chunks gives the same files, also when the chunks end in between the slow axes
+def test_chunksize():
+    folder, dbloc = new_database()
+    measure_run()
+    db_extractor(dbloc, extractpath=os.path.join(folder, 'full'), useopendbconnection=True, suppress_output=True)
+    db_extractor(dbloc, extractpath=os.path.join(folder, 'chunks'), chunksize=7, useopendbconnection=True,
+                 suppress_output=True)
+    db_extractor(dbloc, extractpath=os.path.join(folder, 'chunks_workers'), chunksize=5, workers=2, suppress_output=True)
+    full = folder_files(os.path.join(folder, 'full'))
+    assert folder_files(os.path.join(folder, 'chunks')) == full
+    assert folder_files(os.path.join(folder, 'chunks_workers')) == full
+
+# With a manifest only the new runs are extracted, overwrite=True extracts all runs again
+def test_manifest():
+    folder, dbloc = new_database()
+    measure_run()
+    extractpath = os.path.join(folder, 'manifest')
+    extract = lambda **kwargs: db_extractor(dbloc, extractpath=extractpath, manifest=True, suppress_output=True, **kwargs)
+    batch = lambda **kwargs: db_extractor_batch([dict(dbloc=dbloc, extractpath=extractpath, manifest=True,
+                                                      suppress_output=True, **kwargs)], workers=2)[0]
+    assert [len(result['files']) for result in extract(readonly=True)] == [2]
+    measure_run(name='second')
+    assert [len(result['files']) for result in extract(readonly=True)] == [0, 2]
+    assert [len(result['files']) for result in batch()] == [0, 0]
+    assert [len(result['files']) for result in extract(readonly=True, overwrite=True)] == [2, 2]
+    assert [len(result['files']) for result in batch(overwrite=True)] == [2, 2]
+    assert [len(result['files']) for result in extract(useopendbconnection=True)] == [0, 0]
+    db_extractor(dbloc, extractpath=os.path.join(folder, 'full'), useopendbconnection=True, suppress_output=True)
+    assert folder_files(extractpath) == folder_files(os.path.join(folder, 'full'))
+
+# The grid export keeps the parameters apart from the metadata, also when they have the names of metadata keys
+def test_grid():
+    folder, dbloc = new_database()
+    measure_run(names=('names', 'units', 'header', 'gridded'))
+    db_extractor(dbloc, extractpath=folder, format=['dat', 'grid'], useopendbconnection=True, suppress_output=True)
+    datpath = sorted(glob.glob(os.path.join(folder, '**', '*.dat'), recursive=True))[0] # The map of header
+    dat = np.loadtxt(datpath)
+    assert dat.shape == (42, 3)
+    with np.load(datpath[:-len('.dat')] + '_grid.npz') as grid:
+        assert list(grid['names']) == ['names', 'units', 'header']
+        assert list(grid['units']) == ['V', 'V', 'A']
+        assert grid['header'].item().startswith('Run #1')
+        assert grid['gridded'] == True
+        assert np.array_equal(grid['data/names'], np.unique(dat[:,0]))
+        assert np.array_equal(grid['data/units'], np.unique(dat[:,1]))
+        assert np.array_equal(grid['data/header'], dat[:,2].reshape(6, 7), equal_nan=True)
+
+# The compressed live export decompresses to the same text as the files of db_extractor
+def test_compressed():
+    folder, dbloc = new_database()
+    formats = ['dat.gz', 'dat.zst']
+    live = os.path.join(folder, 'live')
+    measure_run(extractors=lambda runid: [incremental_extractor(dbloc, runid, extractpath=live, format=fmt)
+                                          for fmt in formats])
+    db_extractor(dbloc, extractpath=os.path.join(folder, 'full'), format=['dat'] + formats, useopendbconnection=True,
+                 suppress_output=True)
+    full = folder_files(os.path.join(folder, 'full'))
+    dats = [path for path in full if path.endswith('.dat')]
+    assert len(dats) == 2
+    for path in dats:
+        for fmt in formats:
+            assert dat_text(os.path.join(live, path[:-len('dat')] + fmt)) == full[path]
+            assert dat_text(os.path.join(folder, 'full', path[:-len('dat')] + fmt)) == full[path]
+
+if __name__ == '__main__':
+    for test in [test_incremental, test_readonly, test_workers, test_chunksize, test_manifest, test_grid, test_compressed]:
+        test()
+        print(test.__name__ + ': OK')
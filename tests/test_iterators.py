@@ -0,0 +1,61 @@
+# Checks of the setpoint iterators of doNd: iter_cartprod against cartprod and cartprodmeander, the reflected Gray code
+# order of meander='full', skipping with start, iter_lines and iter_changes.
+#
+# Usage: python tests/test_iterators.py (the functions test_* also run under pytest)
+import numpy as np
+from qctools.doNd import cartprod, cartprodmeander, count_setpoints, iter_cartprod, iter_changes, iter_lines
+
+spaces_list = [[np.linspace(0,1,5)],
+               [np.linspace(0,1,3), np.linspace(-1,1,4)],
+               [np.arange(2), np.linspace(0,1,3), np.array([0.5,0.25,0.125,0.0625])],
+               [np.linspace(0,1,2), np.arange(3), np.linspace(0,2,2), np.linspace(5,6,5)]]
+
+def test_cartprod():
+    for spaces in spaces_list:
+        assert np.array_equal(np.array(list(iter_cartprod(spaces))), cartprod(*spaces))
+        assert np.array_equal(np.array(list(iter_cartprod(spaces, meander=True))), cartprodmeander(*spaces))
+        assert count_setpoints(spaces) == len(cartprod(*spaces))
+
+# Every setpoint once, and every move a single step on a single axis
+def test_full_meander():
+    for spaces in spaces_list:
+        indices = np.array([[list(space).index(value) for space, value in zip(spaces, setpoint)]
+                            for setpoint in iter_cartprod(spaces, meander='full')])
+        assert len(set(map(tuple, indices))) == count_setpoints(spaces)
+        assert (np.abs(np.diff(indices, axis=0)).sum(axis=1) == 1).all()
+
+def test_start():
+    for spaces in spaces_list:
+        for meander in [False, True, 'full']:
+            setpoints = np.array(list(iter_cartprod(spaces, meander)))
+            for start in [0, 1, len(setpoints)//2, len(setpoints)-1, len(setpoints)]:
+                skipped = np.array(list(iter_cartprod(spaces, meander, start))).reshape(-1, len(spaces))
+                assert np.array_equal(skipped, setpoints[start:])
+
+def test_lines():
+    for spaces in spaces_list:
+        nfast = len(spaces[-1])
+        for meander in [False, True, 'full']:
+            setpoints = np.array(list(iter_cartprod(spaces, meander)))
+            for start in [0, 1]:
+                rows = []
+                for slowpoint, line in iter_lines(spaces, meander, start):
+                    assert len(line) == nfast
+                    rows.extend([list(slowpoint) + [value] for value in line])
+                assert np.array_equal(np.array(rows).reshape(-1, len(spaces)), setpoints[start*nfast:])
+
+def test_changes():
+    for spaces in spaces_list:
+        for meander in [False, True, 'full']:
+            previous = None
+            for setpoint, changed in iter_changes(iter_cartprod(spaces, meander)):
+                if previous is None:
+                    assert all(changed)
+                else:
+                    assert changed == [value != old for value, old in zip(setpoint, previous)]
+                previous = setpoint
+
+if __name__ == '__main__':
+    for test in [test_cartprod, test_full_meander, test_start, test_lines, test_changes]:
+        test()
+        print(test.__name__ + ': OK')
@@ -0,0 +1,65 @@
+# Check of the line mode of doNd (line_acquisition) against the point by point measurement of the same sweep, for a
+# function and for a ParameterWithSetpoints that always sweeps in the order of spaces[-1], with and without meander.
+# Also checks that an interrupted line mode run is resumed at the first line that was not completed.
+#
+# Usage: python tests/test_line_mode.py (the functions test_* also run under pytest)
+import numpy as np
+import pytest
+from qcodes.parameters import Parameter, ParameterWithSetpoints
+from qcodes.validators import Arrays
+from qctools.doNd import doNd
+from measurement_setup import new_database, measure, run_matrix
+
+spaces = [np.linspace(0,1,3), np.linspace(0,1,4), np.linspace(0,1,5)]
+
+def sweep_parameters():
+    x, y, z = [Parameter(name, unit='V', set_cmd=None, get_cmd=None, step=0.1, inter_delay=1e-4) for name in 'xyz']
+    a = Parameter('a', unit='A', get_cmd=lambda: x() + 10*y() + 100*z())
+    b = Parameter('b', unit='A', get_cmd=lambda: x()*y() - z())
+    return x, y, z, a, b
+
+def test_function():
+    new_database()
+    x, y, z, a, b = sweep_parameters()
+    acquisition = lambda line: [x() + 10*y() + 100*line, x()*y() - line]
+    for meander in [False, True, 'full']:
+        points = measure([x, y, z], spaces, [a, b], meander=meander)
+        lines = measure([x, y, z], spaces, [a, b], meander=meander, line_acquisition=acquisition)
+        assert np.allclose(run_matrix(points, [x, y, z], [a, b]), run_matrix(lines, [x, y, z], [a, b]))
+
+def test_parameter_with_setpoints():
+    new_database()
+    x, y, z, a, b = sweep_parameters()
+    axis = Parameter('axis', get_cmd=lambda: spaces[-1], vals=Arrays(shape=(len(spaces[-1]),)))
+    line = ParameterWithSetpoints('line', get_cmd=lambda: x() + 10*y() + 100*spaces[-1], setpoints=(axis,),
+                                  vals=Arrays(shape=(len(spaces[-1]),)))
+    for meander in [False, True, 'full']:
+        points = measure([x, y, z], spaces, [a], meander=meander)
+        lines = measure([x, y, z], spaces, [a], meander=meander, line_acquisition=line)
+        assert np.allclose(run_matrix(points, [x, y, z], [a]), run_matrix(lines, [x, y, z], [a]))
+    # The setpoints of the instrument have to match the fastest axis
+    with pytest.raises(SystemExit):
+        doNd([x, y, z], spaces[:2] + [spaces[-1][::-1]], [0, 0, 0], [a], line_acquisition=line, snapshot=False,
+             do_plot=False)
+
+def test_resume():
+    new_database()
+    x, y, z, a, b = sweep_parameters()
+    calls = [0, 4]
+    def acquisition(line):
+        calls[0] += 1
+        if calls[0] == calls[1]:
+            raise RuntimeError('Acquisition failed')
+        return [x() + 10*y() + 100*line]
+    interrupted = measure([x, y, z], spaces, [a], meander=True, line_acquisition=acquisition)
+    calls[1] = None
+    resumed = measure([x, y, z], spaces, [a], meander=True, line_acquisition=acquisition, resume=interrupted)
+    reference = measure([x, y, z], spaces, [a], meander=True, line_acquisition=acquisition)
+    assert len(run_matrix(interrupted, [x, y, z], [a])) == 3*len(spaces[-1])
+    assert np.array_equal(np.vstack([run_matrix(interrupted, [x, y, z], [a]), run_matrix(resumed, [x, y, z], [a])]),
+                          run_matrix(reference, [x, y, z], [a]))
+
+if __name__ == '__main__':
+    for test in [test_function, test_parameter_with_setpoints, test_resume]:
+        test()
+        print(test.__name__ + ': OK')
@@ -0,0 +1,43 @@
+# Check of parallel_ramp in doNd with mock sources that take 0.2 s per set: set parameters of different instruments
+# are set at the same time and the stored data is the same as when they are set one after the other.
+#
+# Usage: python tests/test_parallel_ramp.py (the functions test_* also run under pytest)
+import time
+import numpy as np
+from qcodes.parameters import Parameter
+from qcodes.instrument import Instrument
+from measurement_setup import new_database, measure, same_data, busy_time
+
+def test_parallel_ramp():
+    new_database()
+    sets = []
+    def slow_set(value):
+        start = time.perf_counter()
+        time.sleep(0.2)
+        sets.append((start, time.perf_counter()))
+    instruments = [Instrument('ramp_src1'), Instrument('ramp_src2')]
+    try:
+        instruments[0].add_parameter('x', set_cmd=slow_set, get_cmd=None)
+        instruments[1].add_parameter('y', set_cmd=slow_set, get_cmd=None)
+        instruments[1].add_parameter('z', set_cmd=None, get_cmd=None)
+        x, y, z = instruments[0].x, instruments[1].y, instruments[1].z
+        a = Parameter('a', get_cmd=lambda: x() + 10*y() + 100*z())
+        spaces = [np.linspace(0,1,4), np.linspace(0,1,3), np.linspace(0,1,1)]
+        durations = []
+        runids = []
+        for parallel in [False, True]:
+            sets.clear()
+            runids.append(measure([x, y, z], spaces, [a], checkstepinterdelay=False, parallel_ramp=parallel))
+            durations.append(busy_time(sets))
+        print('Time spent setting, sequential: {:.2f} s, parallel: {:.2f} s'.format(*durations))
+        assert same_data(runids[0], runids[1])
+        # 16 sets: y is set on all 12 setpoints, x on the first one and on its 3 steps, where it runs next to y
+        assert durations[0] > 16*0.2 - 0.05
+        assert durations[1] < 12*0.2 + 0.2
+    finally:
+        for instrument in instruments:
+            instrument.close()
+
+if __name__ == '__main__':
+    test_parallel_ramp()
+    print('test_parallel_ramp: OK')
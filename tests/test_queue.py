@@ -0,0 +1,83 @@
+# Checks of doNd_queue: all sweeps are checked before the first run starts, the runs hold the same data and *.dat
+# files as separate doNd calls, and the dead time between the runs is shorter than between separate doNd calls.
+#
+# Usage: python tests/test_queue.py (the functions test_* also run under pytest)
+import os
+import glob
+import time
+import numpy as np
+import pytest
+import qcodes as qc
+from qcodes.dataset import load_last_experiment
+from qcodes.parameters import Parameter
+from qcodes.instrument import Instrument
+from qctools.doNd import doNd_queue
+from measurement_setup import new_database, measure, last_runid, same_data
+
+# Body of the *.dat file of run runid, without the header that holds the run id
+def dat_body(dbloc, runid):
+    paths = glob.glob(os.path.join(os.path.dirname(dbloc), '**', '{:03d}_*'.format(runid), '*.dat'), recursive=True)
+    with open(paths[0]) as f:
+        return f.readlines()[4:]
+
+# Seconds between the end of every run and the start of the next one
+def dead_times(runids):
+    datasets = [qc.load_by_id(runid) for runid in runids]
+    return [b.run_timestamp_raw - a.completed_timestamp_raw for a, b in zip(datasets[:-1], datasets[1:])]
+
+def test_queue():
+    dbloc = new_database()
+    source = Instrument('queue_src')
+    try:
+        source.add_parameter('x', unit='V', set_cmd=None, get_cmd=None, step=0.1, inter_delay=1e-4)
+        source.add_parameter('y', unit='V', set_cmd=None, get_cmd=None, step=0.1, inter_delay=1e-4)
+        x, y = source.x, source.y
+        a = Parameter('a', unit='A', get_cmd=lambda: x() + 10*y())
+        common = dict(param_set=[x, y], settle_times=[0, 0], param_meas=[a], wait_first_datapoint=0)
+        sweeps = [dict(spaces=[np.linspace(0,1,5), np.linspace(0,k,6)], name='queue' + str(k), **common)
+                  for k in range(1,5)]
+        # An error in the last sweep stops the queue before anything is measured
+        with pytest.raises(SystemExit):
+            doNd_queue(sweeps + [dict(common, spaces=[np.linspace(0,1,5)], name='wrong')], snapshot=False)
+        assert load_last_experiment().data_sets() == []
+        separate = []
+        for sweep in sweeps:
+            sweep = dict(sweep)
+            separate.append(measure(sweep.pop('param_set'), sweep.pop('spaces'), sweep.pop('param_meas'),
+                                    **{k: v for k, v in sweep.items() if k != 'settle_times'}))
+        queued = doNd_queue(sweeps + [dict(param_set=[], spaces=[], settle_times=[], param_meas=[a], name='zerodim',
+                                           wait_first_datapoint=0)], snapshot=False)
+        assert queued[-1] == last_runid()
+        for runid, queuedid in zip(separate, queued):
+            assert same_data(runid, queuedid)
+            assert dat_body(dbloc, runid) == dat_body(dbloc, queuedid)
+        print('Mean dead time between runs, separate: {:.2f} s, queue: {:.2f} s'.format(
+              np.mean(dead_times(separate)), np.mean(dead_times(queued))))
+        assert np.mean(dead_times(queued)) < np.mean(dead_times(separate))
+    finally:
+        source.close()
+
+# The station is filled once for all sweeps, also when set parameters of different instruments have the same name
+def test_queue_snapshot():
+    new_database()
+    gates = [Instrument('queue_gate1'), Instrument('queue_gate2')]
+    try:
+        for gate in gates:
+            gate.add_parameter('voltage', unit='V', set_cmd=None, get_cmd=None, step=0.1, inter_delay=1e-4,
+                               initial_value=0)
+        a = Parameter('a', unit='A', get_cmd=lambda: gates[0].voltage() + 10*gates[1].voltage())
+        sweeps = [dict(param_set=[gate.voltage], spaces=[np.linspace(0,1,5)], settle_times=[0], param_meas=[a],
+                       name='snapshot', wait_first_datapoint=0) for gate in gates]
+        runids = doNd_queue(sweeps)
+        for runid, gate in zip(runids, gates):
+            dataset = qc.load_by_id(runid)
+            assert len(dataset.get_parameter_data('a')['a']['a']) == 5
+            assert gate.name in dataset.snapshot['station']['instruments']
+    finally:
+        for gate in gates:
+            gate.close()
+
+if __name__ == '__main__':
+    for test in [test_queue, test_queue_snapshot]:
+        test()
+        print(test.__name__ + ': OK')
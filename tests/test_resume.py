@@ -0,0 +1,84 @@
+# Checks of resume in doNd: runs that are interrupted and resumed, also several times, with buffer_points, with
+# optimize_order and after a crash before the last checkpoint, together hold the same data as one uninterrupted run.
+#
+# Usage: python tests/test_resume.py (the functions test_* also run under pytest)
+import sys
+import numpy as np
+import pytest
+import qcodes as qc
+from qcodes.parameters import Parameter
+from qctools.doNd import doNd, stored_setpoint_order
+from measurement_setup import new_database, measure, run_matrix
+
+spaces = [np.linspace(0,1,6), np.linspace(0,1,7)]
+
+# Set parameters x and y and readout a, which exits the measurement on readout number reads[1]
+def sweep_parameters(reads):
+    x, y = [Parameter(name, unit='V', set_cmd=None, get_cmd=None, step=0.1, inter_delay=1e-4) for name in 'xy']
+    def get():
+        reads[0] += 1
+        if reads[0] == reads[1]:
+            sys.exit('Compliance reached')
+        return x() + 10*y()
+    return x, y, Parameter('a', unit='A', get_cmd=get)
+
+def concatenated(runids, x, y, a):
+    return np.vstack([run_matrix(runid, [x, y], [a]) for runid in runids])
+
+def test_resume_chain():
+    new_database()
+    reads = [0, None]
+    x, y, a = sweep_parameters(reads)
+    reference = measure([x, y], spaces, [a], meander='full')
+    runids = []
+    buffered = dict(buffer_points=8)
+    for interrupt, resume, kwargs in [(20, False, {}), (15, True, {}), (None, True, {}),
+                                      (17, False, buffered), (None, True, buffered)]:
+        reads[:] = [0, interrupt]
+        runids.append(measure([x, y], spaces, [a], meander='full', resume=runids[-1] if resume else None, **kwargs))
+    assert np.array_equal(concatenated(runids[:3], x, y, a), run_matrix(reference, [x, y], [a]))
+    assert np.array_equal(concatenated(runids[3:], x, y, a), run_matrix(reference, [x, y], [a]))
+    assert qc.load_by_id(runids[1]).metadata['doNd_resumed_from'] == runids[0]
+    assert qc.load_by_id(runids[0]).metadata['doNd_continued_in'] == runids[1]
+    # A complete run is not resumed, a different sweep is refused
+    assert measure([x, y], spaces, [a], meander='full', resume=runids[2]) == runids[-1]
+    with pytest.raises(SystemExit):
+        doNd([x, y], spaces, [0, 0], [a], meander=True, resume=runids[2], snapshot=False, do_plot=False)
+
+# A crash before the next checkpoint leaves doNd_completed behind the stored results
+def test_resume_after_crash():
+    new_database()
+    reads = [0, 25]
+    x, y, a = sweep_parameters(reads)
+    interrupted = measure([x, y], spaces, [a])
+    qc.load_by_id(interrupted).add_metadata('doNd_completed', 10)
+    reads[:] = [0, None]
+    resumed = measure([x, y], spaces, [a], resume=interrupted)
+    reference = measure([x, y], spaces, [a])
+    assert qc.load_by_id(resumed).metadata['doNd_first'] == 24
+    assert np.array_equal(concatenated([interrupted, resumed], x, y, a), run_matrix(reference, [x, y], [a]))
+
+def test_resume_optimize_order():
+    new_database()
+    reads = [0, 9]
+    x, y, a = sweep_parameters(reads)
+    setpoints = np.random.default_rng(0).uniform(0, 1, (25, 2))
+    interrupted = measure([x, y], setpoints, [a], manualsetpoints=True, optimize_order=True)
+    reads[:] = [0, None]
+    resumed = measure([x, y], setpoints, [a], manualsetpoints=True, optimize_order=True, resume=interrupted)
+    order = stored_setpoint_order(interrupted)
+    assert 'setpoint_order' not in qc.load_by_id(resumed).metadata
+    assert np.array_equal(stored_setpoint_order(resumed), order)
+    assert np.allclose(concatenated([interrupted, resumed], x, y, a)[:,:2], setpoints[order])
+    # A run that was measured in the given order is not resumed with optimize_order, which would reorder it
+    reads[:] = [0, 9]
+    interrupted = measure([x, y], setpoints, [a], manualsetpoints=True)
+    reads[:] = [0, None]
+    with pytest.raises(SystemExit):
+        doNd([x, y], setpoints, [0, 0], [a], manualsetpoints=True, optimize_order=True, resume=interrupted,
+             snapshot=False, do_plot=False)
+
+if __name__ == '__main__':
+    for test in [test_resume_chain, test_resume_after_crash, test_resume_optimize_order]:
+        test()
+        print(test.__name__ + ': OK')